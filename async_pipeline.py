@@ -0,0 +1,120 @@
+"""This module provides an asyncio interface to `pipeline.Pipeline`, for services that run on an event loop.
+
+Every CPU-bound step (decoding, calibration, warping, sensor detection) runs on an executor, so the event loop is never blocked.
+The number of images in flight is limited, which gives backpressure to producers, and cancelling a call stops it at the next step boundary.
+
+Usage::
+
+    async with AsyncPipeline(pipeline, max_in_flight=4) as async_pipeline:
+        output = await async_pipeline.process("img/img1.png")
+        async for output in async_pipeline.stream(camera_frames()):
+            ...
+"""
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from find_sensors import loadImage
+from find_sensors import warpImage
+
+
+class AsyncPipeline:
+	"""Runs a `Pipeline` on an executor, with at most `max_in_flight` images being processed at once.
+
+	Note:
+	    Cancelling `process` takes effect at the next step boundary: the step that is already running on the executor finishes, but no further steps are started.
+
+	Attributes:
+	    pipeline (pipeline.Pipeline): The wrapped pipeline.
+	    max_in_flight (int): Maximum number of images being processed at once.
+
+	Args:
+	    pipeline (pipeline.Pipeline): See attributes.
+	    max_in_flight (int, optional): See attributes.
+	    executor (concurrent.futures.Executor, optional): Executor for the CPU-bound steps. Defaults to a `ThreadPoolExecutor` with `max_in_flight` threads,
+	        which works well since OpenCV releases the GIL. It must be able to run `Pipeline` methods (a `ProcessPoolExecutor` would pickle the pipeline for every step).
+	"""
+	def __init__(self, pipeline, max_in_flight=4, executor=None):
+		self.pipeline = pipeline
+		self.max_in_flight = max_in_flight
+
+		self._owns_executor = executor is None
+		self._executor = executor or ThreadPoolExecutor(max_in_flight)
+		self._semaphore = None # Created on first use, inside the event loop.
+
+		# Decode images with the pipeline's scale/color settings.
+		self._image_options = {name: value for name, value in pipeline.params.image.items() if name != "path"}
+
+	async def process(self, img):
+		"""Calibrates an image and detects sensors on it, without blocking the event loop.
+
+		Args:
+		    img (numpy.ndarray or str): Uncalibrated image, or a path to one (decoded on the executor, with the scale/color from `params.image`).
+
+		Returns:
+		    Same as `Pipeline.process`.
+		"""
+		if self._semaphore is None:
+			self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+		async with self._semaphore:
+			if isinstance(img, str):
+				img = await self._run(partial(loadImage, img, **self._image_options))
+
+			transform = await self._run(partial(self.pipeline.findTransform, img))
+			if transform is None:
+				return
+
+			img_calibrated = await self._run(partial(warpImage, img, transform, self.pipeline.tray, lazy=self.pipeline.lazy_warp))
+			best_matches, results = await self._run(partial(self.pipeline.detectSensors, img_calibrated))
+
+			return img_calibrated, best_matches, results
+
+	async def stream(self, source):
+		"""Asynchronous generator which processes images from `source` concurrently, and yields their outputs in order.
+
+		At most `max_in_flight` images are taken from `source` ahead of the one being yielded, so a fast source is slowed down to the pipeline's pace.
+
+		Args:
+		    source (iterable or async iterable): Images or paths, as accepted by `process`.
+
+		Yields:
+		    Same as `Pipeline.process`, for each image.
+		"""
+		pending = collections.deque()
+		try:
+			async for img in _asyncIterate(source):
+				pending.append(asyncio.ensure_future(self.process(img)))
+				if len(pending) >= self.max_in_flight:
+					yield await pending.popleft()
+			while pending:
+				yield await pending.popleft()
+		finally:
+			# If the consumer stops early (or is cancelled), don't leave work running.
+			for task in pending:
+				task.cancel()
+
+	def close(self):
+		"""Shuts down the executor, if it was created by this object."""
+		if self._owns_executor:
+			self._executor.shutdown(wait=False)
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *args):
+		self.close()
+
+	def _run(self, function):
+		return asyncio.get_running_loop().run_in_executor(self._executor, function)
+
+
+async def _asyncIterate(source):
+	"""Iterates over an iterable or an async iterable."""
+	if hasattr(source, "__aiter__"):
+		async for item in source:
+			yield item
+	else:
+		for item in source:
+			yield item
@@ -0,0 +1,90 @@
+"""This module provides a pool of reusable arrays, so that processing a stream of same-sized images doesn't allocate new large arrays for every image.
+Pipeline stages pass the pooled arrays to OpenCV through `dst=`/`result=` and to numpy through `out=`."""
+import logging
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class BufferPool:
+	"""A set of arrays keyed by `(name, shape, dtype)`.
+
+	Note:
+	    A buffer returned by `get` is reused (overwritten) the next time `get` is called with the same key,
+	    i.e. when the next image goes through the same stage. Copy anything that has to outlive that.
+	    A `BufferPool` must not be shared between threads that are processing different images at the same time.
+
+	Attributes:
+	    allocations (int): Number of arrays allocated so far. Stays constant in the steady state.
+	    nbytes (int): Total size of all arrays held by the pool.
+	"""
+	def __init__(self):
+		self._buffers = {}
+		self.allocations = 0
+		self.nbytes = 0
+
+	def get(self, name, shape, dtype=np.uint8):
+		"""Returns the buffer for the given stage name, shape and dtype, allocating it if it doesn't exist yet.
+
+		Args:
+		    name (str): Name of the stage using the buffer, so that different stages never share a buffer.
+		    shape (tuple): Shape of the buffer.
+		    dtype (numpy.dtype, optional): dtype of the buffer.
+
+		Returns:
+		    numpy.ndarray: Uninitialized (or previously used) array.
+		"""
+		key = (name, tuple(shape), np.dtype(dtype))
+		buffer = self._buffers.get(key)
+		if buffer is None:
+			buffer = np.empty(shape, dtype=dtype)
+			self._buffers[key] = buffer
+			self.allocations += 1
+			self.nbytes += buffer.nbytes
+			logging.debug("BufferPool: allocated %s %s for %s" %(shape, np.dtype(dtype), name))
+		return buffer
+
+	def clear(self):
+		"""Releases all buffers."""
+		self._buffers.clear()
+		self.nbytes = 0
+
+
+def getBuffer(pool, name, shape, dtype=np.uint8):
+	"""Convenience function. Returns `pool.get(name, shape, dtype)`, or None (i.e. "let OpenCV/numpy allocate") if `pool` is None."""
+	if pool is None:
+		return None
+	return pool.get(name, shape, dtype)
+
+
+@contextmanager
+def measurePeakMemory():
+	"""Context manager which measures the peak memory allocated while the block runs, using `tracemalloc`.
+
+	Note:
+	    Arrays allocated by numpy are traced, including those handed to OpenCV through `dst=`. Temporary buffers allocated inside OpenCV are not.
+
+	Usage::
+
+	    with measurePeakMemory() as memory:
+	        ...
+	    print(memory["peak"])
+
+	Yields:
+	    dict: After the block exits, `"peak"` holds the peak number of bytes allocated during the block.
+	"""
+	memory = {"peak": 0}
+	was_tracing = tracemalloc.is_tracing()
+	if not was_tracing:
+		tracemalloc.start()
+	elif hasattr(tracemalloc, "reset_peak"): # Python 3.9+. On older versions, an already-running trace may report an earlier peak.
+		tracemalloc.reset_peak()
+	baseline, _ = tracemalloc.get_traced_memory()
+	try:
+		yield memory
+	finally:
+		_, peak = tracemalloc.get_traced_memory()
+		memory["peak"] = peak - baseline
+		if not was_tracing:
+			tracemalloc.stop()
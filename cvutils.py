@@ -4,7 +4,7 @@ import logging
 import cv2
 
 
-def scaleImage(img, scale, interpolation=None):
+def scaleImage(img, scale, interpolation=None, dst=None):
 	"""Scales the image up or down. 
 	
 	Args:
@@ -12,6 +12,7 @@ def scaleImage(img, scale, interpolation=None):
 	    scale (float): Factor by which to scale the image.
 	    interpolation (int, optional): `cv2.INTER_*` constant. If not provided, automatically selecting the best interpolation method
 	        (`cv2.INTER_AREA` for downscaling and `cv2.INTER_CUBIC` for upscaling).
+	    dst (numpy.ndarray, optional): Output array to write the scaled image into, e.g. from a `buffer_pool.BufferPool`.
 	
 	Returns:
 	    numpy.ndarray: Scaled image.
@@ -23,7 +24,7 @@ def scaleImage(img, scale, interpolation=None):
 			interpolation = cv2.INTER_CUBIC
 
 	new_size = (int(img.shape[1]*scale), int(img.shape[0]*scale))
-	output = cv2.resize(img, new_size, interpolation=interpolation)
+	output = cv2.resize(img, new_size, dst=dst, interpolation=interpolation)
 	return output
 
 def getHsv(img):
@@ -58,22 +59,23 @@ def isColorImage(img):
 	"""Returns True if the image array is of the shape (y, x, 3), implying that it's probably a BGR image; False otherwise."""
 	return (img.ndim == 3 and img.shape[2] == 3)
 
-def grayscale(img):
+def grayscale(img, dst=None):
 	"""Converts a BGR image to grayscale."""
-	return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+	return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=dst)
 
-def adaptiveThreshold(img, block_radius=5, c=7):
+def adaptiveThreshold(img, block_radius=5, c=7, dst=None):
 	"""Performs `cv2.adaptiveThreshold`, converting image to grayscale if it isn't already.
 	
 	Args:
 	    img (numpy.ndarray): Image to perform thresholding on. If color image, will be converted to grayscale.
 	    block_radius (int, optional): Radius of the `block_size` parameter passed to `cv2.adaptiveThreshold`.
 	    c (int, optional): `c` parameter passed to `cv2.adaptiveThreshold`.
+	    dst (numpy.ndarray, optional): Single-channel output array, e.g. from a `buffer_pool.BufferPool`. Also used to hold the grayscale conversion.
 	
 	Returns:
 	    numpy.ndarray: Thresholded image.
 	"""
 	if isColorImage(img):
-		img = grayscale(img)
-	img = cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_radius*2+1, c)
+		img = grayscale(img, dst=dst) # cv2.adaptiveThreshold supports working in-place, so the grayscale image can share dst.
+	img = cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_radius*2+1, c, dst=dst)
 	return img
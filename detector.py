@@ -11,30 +11,52 @@ import cv2
 import numpy as np
 from sklearn.cluster import MeanShift
 
+from buffer_pool import getBuffer
 from detector_result import CalibrationDetectorResult
 from detector_result import SensorDetectorResult
+from matching import matchTemplate
 
 
 #TODO: Honestly, these two classes don't need to be classes, they should just be functions.
 class CalibrationDetector:
 	"""Performs template matching and clustering, to find the 4 calibration points.
 	
+	Note:
+	    `detect` doesn't modify the detector, so one detector can be used from several threads at once (as long as each thread uses its own `BufferPool`, if any).
+	
 	Attributes:
 	    clustering_bandwidth (float): Bandwidth for `MeanShift` clusterer.
+	    match_engine (str): Template matching engine, one of `matching.ENGINES`. Default `"opencv"`.
+	        The `"tiled"` engine gives the same scores as `"opencv"` up to rounding (see `matching.matchTemplateTiled`), using several cores on large images.
 	    match_method (int): `cv2.TM_*` constant for template matching. Default `cv2.TM_CCOEFF_NORMED`.
 	    match_threshold (float): Threshold for matches to be considered candidates.
 	        Ideally, this should be as high as possible while still capturing all calibration points, because the clusterer's runtime increases quadratically with number of points.
+	    search_mode (str): `"full"` (default) matches the whole image and clusters the candidates.
+	        `"quadrants"` assumes one calibration point near each corner of the image, and takes the single best match in each corner region, without clustering.
+	        Nothing outside the corner regions can become a match.
+	    quadrant_margin (float): In `"quadrants"` mode, the size of each corner region, as a fraction of the image's width and height. Default 0.5 (the whole quadrant).
+	    early_stop_score (float): In `"quadrants"` mode, if set, each corner is first searched in a region a quarter, then half the size of `quadrant_margin`,
+	        stopping as soon as its best match scores above this. Default None (always search the full corner region).
+	    tile_size (int): Tile size for the `"tiled"` engine (see `matching.matchTemplateTiled`). Default None (derived from the pattern size).
+	    tile_workers (int): Number of threads for the `"tiled"` engine. Default None (the number of CPUs).
+	    map_store (map_store.MatchMapStore): If set, the match map is kept in this store, and can be read back from the result's `match_map`. Default None.
+	        (Not available in `"quadrants"` mode, which never matches the whole image.)
 	"""
 	def __init__(self, params=None, **kwargs):
 		# Available parameters:
 		self.clustering_bandwidth = 40
+		self.match_engine = "opencv"
 		self.match_method = cv2.TM_CCOEFF_NORMED
 		self.match_threshold = 0.8
+		self.search_mode = "full"
+		self.quadrant_margin = 0.5
+		self.early_stop_score = None
+		self.tile_size = None
+		self.tile_workers = None
+		self.map_store = None
 
-		# Combine params and kwargs -- Use params dict and/or kwargs to seed parameters.
-		if params is None:
-			params = {}
-		params.update(kwargs)
+		# Combine params and kwargs -- Use params dict and/or kwargs to seed parameters. (Copied, so that the caller's params are never modified.)
+		params = dict(params or {}, **kwargs)
 
 		# For each parameter given in params or kwargs, tries to set the corresponding attribute on self,
 		# raising an error if the attribute doesn't exist.
@@ -44,9 +66,6 @@ class CalibrationDetector:
 			else:
 				raise AttributeError("Unknown parameter: " + name)
 
-		# Initialize a MeanShift clusterer from sklearn.
-		self._clusterer = MeanShift(self.clustering_bandwidth)
-
 	def _bestMatches(self, match_map, candidates, labels):
 		"""Finds the highest-scoring point in each cluster."""
 		num_matches = len(np.unique(labels))
@@ -61,45 +80,110 @@ class CalibrationDetector:
 
 		return best_matches
 
-	def detect(self, img, pattern):
-		"""Performs template matching and clustering, and returns a CalibrationDetectorResult object encapsulating the results."""
-		match_map = cv2.matchTemplate(img, pattern, self.match_method) # Call the cv2 function that does the template matching.
-		candidates = np.transpose(np.where(match_map > self.match_threshold)) # Get all the matched points that were above the threshold.
+	def detect(self, img, pattern, pool=None):
+		"""Performs template matching and clustering, and returns a CalibrationDetectorResult object encapsulating the results.
+		
+		Args:
+		    img (numpy.ndarray): Image to search.
+		    pattern (numpy.ndarray): Image of the calibration point.
+		    pool (buffer_pool.BufferPool, optional): If provided, the match map and candidate mask are written into buffers from the pool.
+		"""
+		if self.search_mode == "quadrants":
+			return self._detectQuadrants(img, pattern, pool)
+		elif self.search_mode != "full":
+			raise ValueError("Unknown search mode: %s" %self.search_mode)
+
+		map_shape = _matchMapShape(img, pattern)
+		match_map = getBuffer(pool, "CalibrationDetector.match_map", map_shape, np.float32)
+		match_map = matchTemplate(img, pattern, self.match_method, self.match_engine, result=match_map, tile_size=self.tile_size, tile_workers=self.tile_workers) # Do the template matching.
+
+		mask = getBuffer(pool, "CalibrationDetector.mask", map_shape, np.bool_)
+		mask = np.greater(match_map, self.match_threshold, out=mask)
+		candidates = np.argwhere(mask) # Get all the matched points that were above the threshold.
 
 		# If there were no matches, warn and return None.
 		if 0 in candidates.shape:
 			logging.warning("0 matches detected")
 			return
 
-		# Use the MeanShift clusterer to eliminate multiple "matches" for the same object.
-		self._clusterer.set_params(bandwidth=self.clustering_bandwidth)
-		self._clusterer.fit(candidates)
+		# Use a MeanShift clusterer from sklearn to eliminate multiple "matches" for the same object.
+		# A new clusterer is created for each call, so that detect can be called from several threads at once.
+		clusterer = MeanShift(bandwidth=self.clustering_bandwidth)
+		clusterer.fit(candidates)
 
 		# Find the highest-scoring point in each cluster and treat that as the "match".
-		labels = self._clusterer.labels_
+		labels = clusterer.labels_
 		matches = self._bestMatches(match_map, candidates, labels)
 
+		# Keep the match map, if requested (it's overwritten by the next detection if it came from the pool).
+		map_key = None if self.map_store is None else self.map_store.put(match_map)
+
 		# Encapsulate and return.
-		return CalibrationDetectorResult(matches, match_map, pattern)
+		return CalibrationDetectorResult(matches, match_map, pattern, map_store=self.map_store, map_key=map_key)
+
+	def _detectQuadrants(self, img, pattern, pool=None):
+		"""Implements `detect` for the `"quadrants"` search mode."""
+		img_h, img_w = img.shape[:2]
+		pattern_h, pattern_w = pattern.shape[:2]
+
+		if self.early_stop_score is None:
+			fractions = (self.quadrant_margin,)
+		else:
+			fractions = (self.quadrant_margin / 4, self.quadrant_margin / 2, self.quadrant_margin)
+
+		matches = []
+		scores = []
+		for bottom, right in ((False, False), (False, True), (True, False), (True, True)):
+			for fraction in fractions:
+				# The region grows from the corner; it's always at least big enough to hold the pattern.
+				region_h = min(img_h, max(pattern_h, int(img_h * fraction)))
+				region_w = min(img_w, max(pattern_w, int(img_w * fraction)))
+				y1 = img_h - region_h if bottom else 0
+				x1 = img_w - region_w if right else 0
+				region = img[y1:y1 + region_h, x1:x1 + region_w]
+
+				match_map = getBuffer(pool, "CalibrationDetector.quadrant_map", _matchMapShape(region, pattern), np.float32)
+				match_map = matchTemplate(region, pattern, self.match_method, self.match_engine, result=match_map, tile_size=self.tile_size, tile_workers=self.tile_workers)
+				best_match = np.unravel_index(np.argmax(match_map), match_map.shape)
+				best = (best_match[0] + y1, best_match[1] + x1), match_map[best_match]
+
+				if self.early_stop_score is not None and best[1] > self.early_stop_score:
+					break
+
+			if best[1] > self.match_threshold:
+				matches.append(best[0])
+				scores.append(best[1])
+
+		if not matches:
+			logging.warning("0 matches detected")
+			return
+
+		return CalibrationDetectorResult(np.array(matches, dtype=np.int_), None, pattern, scores=np.array(scores, dtype=np.float32))
 
 
 class SensorDetector:
 	"""Performs template matching on each cell in a tray, to determine whether a sensor exists in each cell.
 	
+	Note:
+	    Like `CalibrationDetector`, `detect` doesn't modify the detector and is safe to call from several threads at once.
+	
 	Attributes:
+	    match_engine (str): Template matching engine, one of `matching.ENGINES`. Default `"opencv"`.
+	        If every sensor detector uses `"shared"`, `find_sensors.scoreSensors` computes each cell's window statistics once and shares them between the patterns (see `matching.matchTemplateShared`).
 	    match_method (int): `cv2.TM_*` constant for template matching. Default `cv2.TM_CCOEFF_NORMED`.
 	    match_threshold (float): Threshold for matches to be considered candidates. 
 	        (This scales linearly, not quadratically, unlike `CalibrationDetector`. It should be safe to set this somewhat lower.)
+	    map_store (map_store.MatchMapStore): If set, each cell's match map is kept in this store, and can be read back with the result's `getMatchMap`. Default None.
 	"""
 	def __init__(self, params=None, **kwargs):
 		# Available parameters:
+		self.match_engine = "opencv"
 		self.match_method = cv2.TM_CCOEFF_NORMED
 		self.match_threshold = 0.8
+		self.map_store = None
 
-		# Combine params and kwargs -- Use params dict and/or kwargs to seed parameters.
-		if params is None:
-			params = {}
-		params.update(kwargs)
+		# Combine params and kwargs -- Use params dict and/or kwargs to seed parameters. (Copied, so that the caller's params are never modified.)
+		params = dict(params or {}, **kwargs)
 
 		# For each parameter given in params or kwargs, tries to set the corresponding attribute on self,
 		# raising an error if the attribute doesn't exist.
@@ -109,23 +193,65 @@ class SensorDetector:
 			else:
 				raise AttributeError("Unknown parameter: " + name)
 
-	def detect(self, img, pattern, tray):
-		"""Performs template matching on each cell in the tray, and returns a SensorDetectorResult object encapsulating the results."""
-		offsets = np.full((tray.rows, tray.cols, 2), -1, dtype=np.int_) # Offsets is how far each match is from the top-left of their tray cell (i.e. the image from tray.getCell).
-		scores = np.zeros((tray.rows, tray.cols), dtype=np.float32) # Initialize the scores array with zeros.
-
-		for row, col in tray: # For each cell in the tray:
-			cell = tray.getCell(img, row, col) # Get the sub-image
-			match_map = cv2.matchTemplate(cell, pattern, self.match_method) # Call the cv2 function that does the template matching.
+	def detect(self, img, pattern, tray, cells=None, previous=None, pool=None, integrals=None):
+		"""Performs template matching on each cell in the tray, and returns a SensorDetectorResult object encapsulating the results.
+		
+		Args:
+		    img (numpy.ndarray): The calibrated/transformed image of the tray.
+		    pattern (numpy.ndarray): Image of the sensor to look for.
+		    tray (tray.TrayDefinition): Tray whose cells are searched.
+		    cells (iterable, optional): (row, col) pairs of the cells to search. If not provided, every cell in the tray is searched.
+		    previous (detector_result.SensorDetectorResult, optional): Earlier result for the same pattern and tray.
+		        Cells that aren't in `cells` keep their offsets and scores from `previous`.
+		    pool (buffer_pool.BufferPool, optional): If provided, each cell's match map is written into a buffer from the pool.
+		    integrals (matching.ImageIntegrals, optional): Of `img`, to share window statistics with other patterns, with the `"shared"` engine. Ignored by other engines.
+		"""
+		if previous is None:
+			offsets = np.full((tray.rows, tray.cols, 2), -1, dtype=np.int_) # Offsets is how far each match is from the top-left of their tray cell (i.e. the image from tray.getCell).
+			scores = np.zeros((tray.rows, tray.cols), dtype=np.float32) # Initialize the scores array with zeros.
+			map_keys = self._newMapKeys(tray)
+		else:
+			offsets = np.flip(previous._offsets, axis=2).copy() # Undo the (x, y) conversion done in SensorDetectorResult.__init__.
+			scores = previous.scores.copy()
+			map_keys = self._newMapKeys(tray) if previous._map_keys is None or self.map_store is None else previous._map_keys.copy()
 
-			best_match_flat = np.argmax(match_map) # Finds the index of the highest-scoring point in the whole image (flattened).
-			best_match = np.unravel_index(best_match_flat, match_map.shape) # Get the index of that point in the unflattened array.
+		if cells is None:
+			cells = tray
 
-			# If the match is above the threshold, update the corresponding spots in the offsets and scores arrays.
-			score = match_map[best_match]
-			if score > self.match_threshold:
-				offsets[row, col] = best_match
-				scores[row, col] = score
+		for row, col in cells: # For each cell to be searched:
+			match_map = self._matchCell(img, pattern, tray, row, col, pool, integrals)
+			offsets[row, col], scores[row, col] = self._bestMatch(match_map)
+			if map_keys is not None:
+				map_keys[row, col] = self.map_store.put(match_map)
 
 		# Encapsulate and return.
-		return SensorDetectorResult(offsets, scores, pattern, tray)
+		return SensorDetectorResult(offsets, scores, pattern, tray, map_store=self.map_store, map_keys=map_keys)
+
+	def _matchCell(self, img, pattern, tray, row, col, pool=None, integrals=None):
+		"""Performs template matching on a single cell, and returns its match map."""
+		cell = tray.getCell(img, row, col) # Get the sub-image
+		x1, y1, _, _ = tray.getBounds(row, col)
+		match_map = getBuffer(pool, "SensorDetector.match_map", _matchMapShape(cell, pattern), np.float32)
+		return matchTemplate(cell, pattern, self.match_method, self.match_engine, result=match_map, integrals=integrals, origin=(y1, x1)) # Do the template matching.
+
+	def _newMapKeys(self, tray):
+		"""Returns an array for the `map_store` key of each cell's match map, or None if match maps aren't kept."""
+		if self.map_store is None:
+			return
+		return np.full((tray.rows, tray.cols), -1, dtype=np.int_)
+
+	def _bestMatch(self, match_map):
+		"""Returns the (offset, score) of the highest-scoring point in a cell's match map, or ((-1, -1), 0) if it isn't above the threshold."""
+		best_match_flat = np.argmax(match_map) # Finds the index of the highest-scoring point in the whole image (flattened).
+		best_match = np.unravel_index(best_match_flat, match_map.shape) # Get the index of that point in the unflattened array.
+
+		# If the match is above the threshold, return the offset and score of the match.
+		score = match_map[best_match]
+		if score > self.match_threshold:
+			return best_match, score
+		return (-1, -1), 0
+
+
+def _matchMapShape(img, pattern):
+	"""Returns the shape of the array output by `cv2.matchTemplate(img, pattern, ...)`."""
+	return (img.shape[0] - pattern.shape[0] + 1, img.shape[1] - pattern.shape[1] + 1)
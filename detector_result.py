@@ -42,18 +42,30 @@ class CalibrationDetectorResult (DetectorResult):
 	    scores (numpy.ndarray): The quality of match ([0..1]).
 
 	Args:
-	    Passed from CalibrationDetector.
+	    Passed from CalibrationDetector. `scores` is given instead of being read from `match_map` when there's no map of the whole image.
 	"""
-	def __init__(self, matches, match_map, pattern):
+	def __init__(self, matches, match_map, pattern, scores=None, map_store=None, map_key=None):
 		self._positions = np.flip(matches, axis=1)
+		self._map_store = map_store
+		self._map_key = map_key
 
-		self.scores = match_map[tuple(np.transpose(matches))]
+		if scores is None:
+			scores = match_map[tuple(np.transpose(matches))]
+		self.scores = scores
 
 		self._pattern_shape = np.array(pattern.shape[:2])
 
 		centers = matches + self._pattern_shape // 2
 		self.centers = np.flip(centers, axis=1)
 
+	@property
+	def match_map(self):
+		"""numpy.ndarray: The (quantized) match map of the whole image, decompressed from the detector's `map_store`,
+		or None if the detector had no `map_store` or the map has been evicted from it."""
+		if self._map_key is None:
+			return
+		return self._map_store.get(self._map_key)
+
 	def axPaint(self, ax):
 		"""Display the matches' locations on the given `ax` using matplotlib patches.
 		
@@ -86,8 +98,10 @@ class SensorDetectorResult (DetectorResult):
 	Args:
 	    Passed from SensorDetector.
 	"""
-	def __init__(self, offsets, scores, pattern, tray):
+	def __init__(self, offsets, scores, pattern, tray, map_store=None, map_keys=None):
 		self._offsets = np.flip(offsets, axis=2)
+		self._map_store = map_store
+		self._map_keys = map_keys
 		self.scores = scores
 		self.matches = scores > 0
 		self._tray = tray
@@ -98,6 +112,21 @@ class SensorDetectorResult (DetectorResult):
 		centers = np.where(offsets != -1, centers, -1)
 		self.centers = np.flip(centers, axis=2)
 
+	def getMatchMap(self, row, col):
+		"""Returns the (quantized) match map of a cell, decompressed from the detector's `map_store`,
+		or None if the detector had no `map_store` or the map has been evicted from it."""
+		if self._map_keys is None or self._map_keys[row, col] < 0:
+			return
+		return self._map_store.get(self._map_keys[row, col])
+
+	@property
+	def match_maps(self):
+		"""numpy.ndarray: Object array of shape (tray.rows, tray.cols) with the result of `getMatchMap` for each cell. Decompresses every cell."""
+		match_maps = np.empty(self.scores.shape, dtype=object)
+		for row, col in self._tray:
+			match_maps[row, col] = self.getMatchMap(row, col)
+		return match_maps
+
 	def axPaint(self, ax):
 		"""Display the matches' locations on the given `ax` using matplotlib patches.
 		
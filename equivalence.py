@@ -0,0 +1,234 @@
+"""This module checks that faster detection modes (matching engines, search modes, lazy warping, etc.) give the same answers as the reference configuration.
+
+A mode is a set of changes to `parameters.yml` (see `equivalence.yml`). Every mode is run over a corpus of trays, and each output is compared with
+the output of the reference configuration on the same image. The comparison is summarized next to the mode's timing, and checked against tolerances,
+so that a mode is only made the default once it has been shown to agree with the reference.
+"""
+import glob
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+from find_sensors import loadImage
+from find_sensors import warpImage
+from pipeline import Pipeline
+from yaml_config import freeze
+from yaml_config import thaw
+
+
+DEFAULT_TOLERANCE = {
+	"min_identical": 1.0, # Fraction of images whose `best_matches` must be identical to the reference.
+	"max_center_px": 1.0, # Largest allowed distance between a sensor's center and the reference center, for cells matched in both.
+	"max_score_delta": 0.01, # Largest allowed difference between a cell's score and the reference score.
+	"max_calibration_px": 1.0, # Largest allowed distance between a calibration point and the reference point.
+	"max_failures": 0, # Number of images allowed to fail calibration when the reference didn't.
+}
+
+
+def loadCorpus(params, images=(), synthetic=None):
+	"""Returns the list of images to compare modes on.
+
+	Args:
+	    params (yaml_config.YAMLDict): Data loaded from `parameters.yml`. Images are loaded with the scale/color from `params.image`.
+	    images (iterable, optional): Paths or glob patterns of captured images.
+	    synthetic (dict, optional): If provided, keyword arguments for `syntheticCorpus`, which is run on the image at `params.image.path`.
+
+	Returns:
+	    list: Images (numpy.ndarray).
+	"""
+	options = {name: value for name, value in params.image.items() if name != "path"}
+	paths = [path for pattern in images for path in sorted(glob.glob(pattern))]
+	corpus = [loadImage(path, **options) for path in paths]
+	if synthetic:
+		corpus += syntheticCorpus(loadImage(**params.image), **synthetic)
+	return corpus
+
+
+def syntheticCorpus(img, count=20, seed=0, jitter=0.01, gain=0.1, noise=2.0):
+	"""Returns variations of a tray image: each is tilted by a random perspective change, with a random brightness change and sensor noise.
+
+	Args:
+	    img (numpy.ndarray): Uncalibrated image of a tray.
+	    count (int, optional): Number of variations.
+	    seed (int, optional): Random seed, so that the corpus is the same on every run.
+	    jitter (float, optional): Each image corner moves by up to this fraction of the image size.
+	    gain (float, optional): Brightness is multiplied by a random factor in [1 - gain, 1 + gain].
+	    noise (float, optional): Standard deviation of the added Gaussian noise.
+
+	Returns:
+	    list: Images (numpy.ndarray), of the same shape and dtype as `img`.
+	"""
+	rng = np.random.default_rng(seed)
+	h, w = img.shape[:2]
+	corners = np.float32(((0, 0), (w, 0), (w, h), (0, h)))
+
+	corpus = []
+	for _ in range(count):
+		moved = corners + (rng.uniform(-jitter, jitter, corners.shape) * (w, h)).astype(np.float32)
+		variation = cv2.warpPerspective(img, cv2.getPerspectiveTransform(corners, moved), (w, h), borderMode=cv2.BORDER_REPLICATE)
+		variation = variation.astype(np.float32) * rng.uniform(1 - gain, 1 + gain) + rng.normal(0, noise, variation.shape)
+		corpus.append(np.clip(variation, 0, 255).astype(img.dtype))
+	return corpus
+
+
+def modePipeline(params, tray, mode):
+	"""Creates the `Pipeline` for a mode.
+
+	Args:
+	    params (yaml_config.YAMLDict): Reference parameters.
+	    tray (tray.TrayDefinition): Tray definition.
+	    mode (dict): Changes to the reference. `params` is merged into the parameters, `sensor_detector` is merged into every sensor detector's
+	        `detector` section, and `lazy_warp` is passed to `Pipeline`. All are optional; an empty mode is the reference.
+	"""
+	params = thaw(params)
+	_merge(params, mode.get("params", {}))
+	for detector_params in params["sensor_detectors"]:
+		_merge(detector_params["detector"], mode.get("sensor_detector", {}))
+	return Pipeline(freeze(params), tray, lazy_warp=mode.get("lazy_warp", False))
+
+
+def _merge(target, changes):
+	"""Recursively merges the dict `changes` into the dict `target`."""
+	for key, value in changes.items():
+		if isinstance(value, dict) and isinstance(target.get(key), dict):
+			_merge(target[key], value)
+		else:
+			target[key] = value
+
+
+def runMode(pipeline, corpus, warmup=1):
+	"""Processes every image in the corpus, keeping what's needed for `compareRuns`.
+
+	Args:
+	    pipeline (pipeline.Pipeline): Pipeline of the mode.
+	    corpus (list): Images.
+	    warmup (int, optional): Number of untimed runs on the first image, before timing starts.
+
+	Returns:
+	    list: For each image, a dict with `calibration_points` (`shape=(4,2)`), `best_matches`, `scores` and `centers` (stacked over sensor types), and `ms`.
+	        All but `ms` are None if calibration failed.
+	"""
+	for _ in range(warmup):
+		pipeline.process(corpus[0])
+
+	runs = []
+	for img in corpus:
+		t0 = perf_counter()
+		transform = pipeline.findTransform(img)
+		if transform is not None:
+			img_calibrated = warpImage(img, transform, pipeline.tray, lazy=pipeline.lazy_warp)
+			best_matches, results = pipeline.detectSensors(img_calibrated)
+		ms = (perf_counter() - t0) * 1000
+
+		if transform is None:
+			runs.append({"calibration_points": None, "best_matches": None, "scores": None, "centers": None, "ms": ms})
+		else:
+			runs.append({
+				"calibration_points": _calibrationPoints(transform),
+				"best_matches": best_matches,
+				"scores": np.stack([result.scores for result in results]),
+				"centers": np.stack([result.centers for result in results]),
+				"ms": ms,
+			})
+	return runs
+
+
+def _calibrationPoints(transform):
+	"""Returns where a transform's output corners are in the input image, i.e. the calibration points it was made from, in corner order."""
+	w, h = transform.image_shape
+	corners = np.float32(((0, 0), (w, 0), (w, h), (0, h))).reshape(-1, 1, 2)
+	return cv2.perspectiveTransform(corners, np.linalg.inv(transform.matrix)).reshape(-1, 2)
+
+
+def compareRuns(reference, runs):
+	"""Summarizes how a mode's outputs differ from the reference outputs on the same corpus.
+
+	Args:
+	    reference (list): Output of `runMode` for the reference.
+	    runs (list): Output of `runMode` for the mode.
+
+	Returns:
+	    dict: `images`, `identical` (fraction of images with identical `best_matches`), `cell_agreement` (fraction of cells with the same sensor type),
+	        `max_center_px`, `max_score_delta`, `max_calibration_px`, `failures` (images that failed calibration when the reference didn't),
+	        `median_ms`, and `speedup` (reference median time / this mode's median time).
+	"""
+	identical = 0
+	cells_agreeing = 0
+	cells = 0
+	failures = 0
+	max_center = 0.0
+	max_score_delta = 0.0
+	max_calibration = 0.0
+
+	for expected, actual in zip(reference, runs):
+		if expected["best_matches"] is None:
+			identical += actual["best_matches"] is None
+			continue
+		cells += expected["best_matches"].size
+		if actual["best_matches"] is None:
+			failures += 1
+			continue
+
+		identical += np.array_equal(expected["best_matches"], actual["best_matches"])
+		cells_agreeing += np.count_nonzero(expected["best_matches"] == actual["best_matches"])
+		max_score_delta = max(max_score_delta, float(np.abs(expected["scores"] - actual["scores"]).max()))
+		max_calibration = max(max_calibration, float(np.linalg.norm(expected["calibration_points"] - actual["calibration_points"], axis=1).max()))
+
+		# Centers are -1 where a sensor type didn't match; only compare cells where it matched in both.
+		both = (expected["scores"] > 0) & (actual["scores"] > 0)
+		if np.any(both):
+			max_center = max(max_center, float(np.linalg.norm(expected["centers"][both] - actual["centers"][both], axis=1).max()))
+
+	median_ms = float(np.median([run["ms"] for run in runs]))
+	return {
+		"images": len(runs),
+		"identical": identical / len(runs),
+		"cell_agreement": cells_agreeing / cells if cells else 1.0,
+		"max_center_px": max_center,
+		"max_score_delta": max_score_delta,
+		"max_calibration_px": max_calibration,
+		"failures": failures,
+		"median_ms": median_ms,
+		"speedup": float(np.median([run["ms"] for run in reference])) / median_ms,
+	}
+
+
+def checkTolerance(report, tolerance=None):
+	"""Checks a report from `compareRuns` against tolerances (missing entries default to `DEFAULT_TOLERANCE`).
+
+	Returns:
+	    list: Description of each tolerance that was exceeded. Empty if the mode passes.
+	"""
+	tolerance = dict(DEFAULT_TOLERANCE, **(tolerance or {}))
+	violations = []
+	if report["identical"] < tolerance["min_identical"]:
+		violations.append("identical %.3f < %.3f" %(report["identical"], tolerance["min_identical"]))
+	for name in ("max_center_px", "max_score_delta", "max_calibration_px", "max_failures"):
+		key = "failures" if name == "max_failures" else name
+		if report[key] > tolerance[name]:
+			violations.append("%s %g > %g" %(key, report[key], tolerance[name]))
+	return violations
+
+
+def compareModes(params, tray, modes, corpus, tolerance=None):
+	"""Runs the reference and every mode over the corpus, and checks each mode against the tolerances.
+
+	Args:
+	    params (yaml_config.YAMLDict): Reference parameters.
+	    tray (tray.TrayDefinition): Tray definition.
+	    modes (dict): Mode (see `modePipeline`) by name. A mode may have its own `tolerance`, merged over `tolerance`,
+	        for modes that are knowingly approximate (e.g. different floating point rounding).
+	    corpus (list): Images.
+	    tolerance (dict, optional): Tolerances for all modes (see `DEFAULT_TOLERANCE`).
+
+	Returns:
+	    dict: For each mode name (and `"reference"`), the report from `compareRuns`, with the list of `violations` added.
+	"""
+	reference = runMode(modePipeline(params, tray, {}), corpus)
+	reports = {"reference": dict(compareRuns(reference, reference), violations=[])}
+	for name, mode in modes.items():
+		report = compareRuns(reference, runMode(modePipeline(params, tray, mode), corpus))
+		report["violations"] = checkTolerance(report, dict(tolerance or {}, **mode.get("tolerance", {})))
+		reports[name] = report
+	return reports
@@ -1,84 +1,268 @@
 """In theory, all other python modules in this package (other than the `main` files of course) are general enough to be useful for any CV project.
 This module steps down one level of generalization, and provides functions that each perform one step of the specific task of finding sensors on a calibrated tray."""
 import logging
+from itertools import combinations
 
 import cv2
 import numpy as np
 
+from buffer_pool import getBuffer
 from cvutils import adaptiveThreshold
 from cvutils import scaleImage
 from detector import CalibrationDetector
 from detector import SensorDetector
+from matching import matchTemplate
+from matching import ImageIntegrals
 from transform import getPerspectiveTransform
+from transform import LazyWarpedImage
 
 
-def loadImage(path, scale=1, color=True):
-	"""Loads an image by path at a specified scale."""
+def loadImage(path, scale=1, color=True, dst=None):
+	"""Loads an image by path at a specified scale (optionally scaling it into `dst`)."""
 	mode = cv2.IMREAD_COLOR if color else cv2.IMREAD_GRAYSCALE
 	img = cv2.imread(path, mode)
 	if img is None:
 		raise FileNotFoundError("No such file: " + path)
-	img = scaleImage(img, scale)
+	img = scaleImage(img, scale, dst=dst)
 	return img
 
 
-def calibrate(img, params, tray):
+def calibrate(img, params, tray, pool=None, lazy=False):
 	"""Given an uncalibrated image (with 4 calibration points visible), finds the 4 calibration points and transforms the image into a calibrated image.
 	
 	Args:
 	    img (numpy.ndarray): Image to be transformed.
 	    params (yaml_config.YAMLDict): Data loaded from `parameters.yml`.
 	    tray (tray.TrayDefinition): `TrayDefinition` object which determines the height/width of the output image.
+	    pool (buffer_pool.BufferPool, optional): If provided, intermediate images and the output image are written into buffers from the pool.
+	        The output image is then overwritten by the next call to `calibrate` with the same pool.
+	    lazy (bool, optional): If True, returns a `transform.LazyWarpedImage`, which only warps the regions that are later read from it (e.g. tray cells).
 	
 	Returns:
 	    numpy.ndarray: Transformed image, of the shape (tray.height, tray.width, 3) for color images, or (tray.height, tray.width) for grayscale images.
 	"""
+	pattern = loadCalibrationPattern(params)
+	detector = CalibrationDetector(**params.calibration_detector.detector)
+
+	transform = findTransform(img, pattern, detector, params.calibration_detector.preprocessing, tray, pool)
+	if transform is None:
+		return
+
+	return warpImage(img, transform, tray, pool, lazy)
+
+
+def loadCalibrationPattern(params):
+	"""Loads the calibration pattern, and passes it through the same adaptiveThreshold filter as the images it will be matched against."""
 	pattern = loadImage(**params.calibration_detector.pattern)
+	return adaptiveThreshold(pattern, **params.calibration_detector.preprocessing)
 
-	# First, pass both the image and the pattern through an adaptiveThreshold filter.
-	detector_img = adaptiveThreshold(img, **params.calibration_detector.preprocessing)
-	pattern = adaptiveThreshold(pattern, **params.calibration_detector.preprocessing)
 
-	# Detect calibration points.
-	detector = CalibrationDetector(**params.calibration_detector.detector)
-	result = detector.detect(detector_img, pattern)
+def findTransform(img, pattern, detector, preprocessing, tray, pool=None):
+	"""The first step of `calibrate`: finds the 4 calibration points, and the transform that maps them onto the calibrated image.
+	
+	Args:
+	    img (numpy.ndarray): Uncalibrated image.
+	    pattern (numpy.ndarray): Calibration pattern, from `loadCalibrationPattern`.
+	    detector (detector.CalibrationDetector): Detector used to find the calibration points.
+	    preprocessing (yaml_config.YAMLDict): `params.calibration_detector.preprocessing`.
+	    tray (tray.TrayDefinition): `TrayDefinition` object which determines the height/width of the output image.
+	    pool (buffer_pool.BufferPool, optional): See `calibrate`.
+	
+	Returns:
+	    transform.PerspectiveTransform: The transform, or None if fewer than 4 calibration points were found.
+	"""
+	result = _detectCalibrationPoints(img, pattern, detector, preprocessing, pool)
 
 	# Assuming at least 4 calibration points found...
-	if len(result) < 4:
-		logging.error("Only found %d out of 4 required calibration points." %(len(result)))
+	num_found = 0 if result is None else len(result)
+	if num_found < 4:
+		logging.error("Only found %d out of 4 required calibration points." %(num_found))
 		return
 
-	# PerspectiveTransform the image and return.
-	transform = getPerspectiveTransform(img, result[:4], (tray.height, tray.width))
-	img_transformed = transform(img)
+	return getPerspectiveTransform(img, result[:4], (tray.height, tray.width))
+
+
+def findTransforms(img, pattern, detector, preprocessing, tray, count, pool=None):
+	"""Like `findTransform`, for an image containing several trays of the same type: finds all the calibration points in one search,
+	then groups them into one set of 4 per tray (see `groupCalibrationPoints`).
+	
+	Args:
+	    count (int): Number of trays in the image.
+	    Others: See `findTransform`.
+	
+	Returns:
+	    list: `transform.PerspectiveTransform` for each tray found (up to `count`), ordered left to right, then top to bottom.
+	"""
+	result = _detectCalibrationPoints(img, pattern, detector, preprocessing, pool)
+
+	num_found = 0 if result is None else len(result)
+	if num_found < 4 * count:
+		logging.warning("Only found %d out of %d calibration points for %d trays." %(num_found, 4 * count, count))
+	if num_found < 4:
+		return []
+
+	transforms = []
+	for points in groupCalibrationPoints(result.centers, tray, count):
+		bounds = tuple(points.min(axis=0)) + tuple(points.max(axis=0))
+		transforms.append(getPerspectiveTransform(img, points, (tray.height, tray.width), bounds))
+	return transforms
+
+
+def groupCalibrationPoints(points, tray, count, neighbours=7):
+	"""Groups calibration points into sets of 4, one set per tray, using the tray's geometry.
 	
+	Starting from the top-left-most point not yet used, each group is the point plus the 3 of its nearest neighbours that together look most like the tray:
+	opposite sides and diagonals of equal length, and the same width/height ratio as `tray`.
+	
+	Args:
+	    points (numpy.ndarray): (x, y) of each calibration point (`shape=(n,2)`).
+	    tray (tray.TrayDefinition): Tray whose geometry the groups should match.
+	    count (int): Maximum number of groups.
+	    neighbours (int, optional): Number of nearest neighbours considered for each group.
+	
+	Returns:
+	    list: Array of 4 points (`shape=(4,2)`) for each group, ordered left to right, then top to bottom.
+	"""
+	points = np.asarray(points, dtype=np.float32)
+	aspect = tray.width / tray.height
+	remaining = list(range(len(points)))
+	groups = []
+
+	while len(groups) < count and len(remaining) >= 4:
+		start = min(remaining, key=lambda i: points[i].sum())
+		others = sorted((i for i in remaining if i != start), key=lambda i: np.linalg.norm(points[i] - points[start]))[:neighbours]
+
+		best_score, best_group = None, None
+		for trio in combinations(others, 3):
+			group = (start,) + trio
+			score = _quadScore(points[list(group)], aspect)
+			if best_score is None or score < best_score:
+				best_score, best_group = score, group
+
+		groups.append(points[list(best_group)])
+		remaining = [i for i in remaining if i not in best_group]
+
+	groups.sort(key=lambda group: tuple(group.mean(axis=0)))
+	return groups
+
+
+def _quadScore(quad, aspect):
+	"""Returns how far 4 points are from forming a rectangle with the given width/height ratio (0 is a perfect match)."""
+	# Put the points in order around their centroid, so consecutive points share a side.
+	centered = quad - quad.mean(axis=0)
+	quad = quad[np.argsort(np.arctan2(centered[:, 1], centered[:, 0]))]
+
+	sides = np.linalg.norm(quad - np.roll(quad, -1, axis=0), axis=1)
+	diagonals = np.linalg.norm(quad[:2] - quad[2:], axis=1)
+	if np.any(sides == 0):
+		return np.inf
+
+	# Sides 0 and 2 are opposite, as are 1 and 3. Work out which pair is horizontal.
+	side_vectors = np.roll(quad, -1, axis=0) - quad
+	if abs(side_vectors[0, 0]) >= abs(side_vectors[0, 1]):
+		width, height = sides[0] + sides[2], sides[1] + sides[3]
+	else:
+		width, height = sides[1] + sides[3], sides[0] + sides[2]
+
+	return (abs(np.log(sides[0] / sides[2])) + abs(np.log(sides[1] / sides[3]))
+		+ abs(np.log(diagonals[0] / diagonals[1])) + abs(np.log(width / height / aspect)))
+
+
+def warpImage(img, transform, tray, pool=None, lazy=False):
+	"""The second step of `calibrate`: transforms the image into a calibrated image, using the transform from `findTransform`.
+	If `lazy`, returns a `transform.LazyWarpedImage` instead of warping the whole image."""
+	if lazy:
+		return LazyWarpedImage(transform, img)
+
+	img_transformed = getBuffer(pool, "calibrate.transformed", (int(tray.height), int(tray.width)) + img.shape[2:], img.dtype)
+	img_transformed = transform.transformImage(img, dst=img_transformed)
 	return img_transformed
 
 
-def detectSensors(img, params, tray):
+def calibrateMulti(img, params, tray, count, lazy=False):
+	"""Like `calibrate`, for an image containing `count` trays of the same type side by side. The calibration search is only done once.
+	
+	Returns:
+	    list: Transformed image of each tray found, ordered left to right, then top to bottom.
+	"""
+	pattern = loadCalibrationPattern(params)
+	detector = CalibrationDetector(**params.calibration_detector.detector)
+
+	transforms = findTransforms(img, pattern, detector, params.calibration_detector.preprocessing, tray, count)
+	return [warpImage(img, transform, tray, lazy=lazy) for transform in transforms]
+
+
+def _detectCalibrationPoints(img, pattern, detector, preprocessing, pool=None):
+	"""Thresholds the image, and returns the `CalibrationDetectorResult` for the calibration points in it (or None)."""
+	# First, pass the image through an adaptiveThreshold filter (like the pattern).
+	detector_img = getBuffer(pool, "calibrate.threshold", img.shape[:2], np.uint8)
+	detector_img = adaptiveThreshold(img, dst=detector_img, **preprocessing)
+
+	# Detect calibration points.
+	return detector.detect(detector_img, pattern, pool=pool)
+
+
+def detectSensors(img, params, tray, pool=None):
 	"""Given a calibrated image and tray specification, finds which tray cells contain sensors.
 	
 	Args:
-	    img (numpy.ndarray): Transformed image of the tray.
+	    img (numpy.ndarray or transform.LazyWarpedImage): Transformed image of the tray.
 	    params (yaml_config.YAMLDict): Data loaded from `parameters.yml`.
 	    tray (tray.TrayDefinition): `TrayDefinition` object which determines the number and size of cells in the tray.
+	    pool (buffer_pool.BufferPool, optional): If provided, match maps and the combined scores array are written into buffers from the pool.
 	
 	Returns:
 	    numpy.ndarray: An array of shape (tray.rows, tray.cols), where each cell is an index representing the type of sensor in that cell
 	        (0 for the first sensor defined in the config file, 1 for the second, etc.), or -1 if no match detected.
 	"""
+	patterns = [loadImage(**detector_params.pattern) for detector_params in params.sensor_detectors]
+	detectors = [SensorDetector(**detector_params.detector) for detector_params in params.sensor_detectors]
+
+	return scoreSensors(img, patterns, detectors, tray, pool)
 
+
+def scoreSensors(img, patterns, detectors, tray, pool=None):
+	"""Does the work of `detectSensors`, given the already loaded sensor patterns and their detectors.
+	
+	Args:
+	    img (numpy.ndarray): Transformed image of the tray.
+	    patterns (list): Pattern for each type of sensor.
+	    detectors (list): `SensorDetector` for each type of sensor.
+	    tray (tray.TrayDefinition): `TrayDefinition` object which determines the number and size of cells in the tray.
+	    pool (buffer_pool.BufferPool, optional): See `detectSensors`.
+	
+	Returns:
+	    Same as `detectSensors`.
+	"""
 	# For each type of sensor, detect matches using SensorDetector.
+	# With the "shared" engine, each cell's window statistics are computed once, for every pattern.
+	integrals = ImageIntegrals(img) if _canShareMatching(img, patterns, detectors) else None
 	results = []
-	for detector_params in params.sensor_detectors:
-		pattern = loadImage(**detector_params.pattern)
-		detector = SensorDetector(**detector_params.detector)
+	for detector, pattern in zip(detectors, patterns):
+		results.append(detector.detect(img, pattern, tray, pool=pool, integrals=integrals))
+
+	best_matches = combineResults(results, pool)
+
+	return best_matches, results
 
-		result = detector.detect(img, pattern, tray)
-		results.append(result)
 
+def combineResults(results, pool=None):
+	"""Combines the results of each type of sensor into a single array of sensor types.
+	
+	Args:
+	    results (list): `SensorDetectorResult` for each type of sensor, in the order they are defined in the config file.
+	    pool (buffer_pool.BufferPool, optional): If provided, the combined scores array is written into a buffer from the pool.
+	
+	Returns:
+	    numpy.ndarray: An array of shape (tray.rows, tray.cols), as returned by `detectSensors`.
+	"""
 	# Creates an array combining the detector scores for each type of sensor.
-	all_scores = np.stack([result.scores for result in results])
+	all_scores = getBuffer(pool, "combineResults.all_scores", (len(results),) + results[0].scores.shape, np.float32)
+	if all_scores is None:
+		all_scores = np.stack([result.scores for result in results])
+	else:
+		for i, result in enumerate(results):
+			all_scores[i] = result.scores
 
 	best_scores = np.amax(all_scores, axis=0) # Determine the highest score in each cell.
 	best_sensor_type = np.argmax(all_scores, axis=0) # Determine the highest-scoring sensor type in each cell.
@@ -87,4 +271,81 @@ def detectSensors(img, params, tray):
 	# But if none of them matched (i.e. if none of the scores were > 0), put in -1.
 	best_matches = np.where(best_scores > 0, best_sensor_type, -1)
 
-	return best_matches, results
+	return best_matches
+
+
+def detectSensorsBatch(images, params, tray):
+	"""Like `detectSensors`, for a batch of calibrated images of the same tray (e.g. a chunk of a `tray_archive.TrayArchive`), with the results as arrays.
+	
+	Note:
+	    This isn't a faster way to score images: the matching, which takes nearly all the time, is the same as `detectSensors` on each image.
+	
+	Args:
+	    images (numpy.ndarray): Stacked transformed images of the tray (`shape=(n, tray.height, tray.width)`), or a list of them.
+	    params (yaml_config.YAMLDict): Data loaded from `parameters.yml`.
+	    tray (tray.TrayDefinition): `TrayDefinition` object which determines the number and size of cells in the tray.
+	
+	Returns:
+	    Same as `scoreSensorsBatch`.
+	"""
+	patterns = [loadImage(**detector_params.pattern) for detector_params in params.sensor_detectors]
+	detectors = [SensorDetector(**detector_params.detector) for detector_params in params.sensor_detectors]
+
+	return scoreSensorsBatch(images, patterns, detectors, tray)
+
+
+def scoreSensorsBatch(images, patterns, detectors, tray):
+	"""Does the work of `detectSensorsBatch`, given the already loaded sensor patterns and their detectors.
+	
+	Each cell of each image is matched separately, as in `SensorDetector.detect` (so the matching costs the same as `scoreSensors` on each image),
+	into one array of cell match maps for the whole batch (padded with -inf, since cells can differ in size by a pixel).
+	Every cell's best match is then found for all the images at once, instead of one cell at a time.
+	Scores are the same as `scoreSensors`.
+	
+	Returns:
+	    numpy.ndarray: `best_matches` for each image (`shape=(n, tray.rows, tray.cols)`), as returned by `detectSensors`.
+	    numpy.ndarray: Scores for each image and type of sensor (`shape=(n, len(patterns), tray.rows, tray.cols)`), as in `SensorDetectorResult.scores`.
+	    numpy.ndarray: Centers for each image and type of sensor (`shape=(n, len(patterns), tray.rows, tray.cols, 2)`), as in `SensorDetectorResult.centers`.
+	"""
+	num_images = len(images)
+	scores = np.zeros((num_images, len(patterns), tray.rows, tray.cols), dtype=np.float32)
+	centers = np.full((num_images, len(patterns), tray.rows, tray.cols, 2), -1, dtype=np.int_)
+
+	bounds = [tray.getBounds(row, col) for row, col in tray]
+	max_cell_h = max(y2 - y1 for x1, y1, x2, y2 in bounds)
+	max_cell_w = max(x2 - x1 for x1, y1, x2, y2 in bounds)
+	map_shapes = [(max_cell_h - pattern.shape[0] + 1, max_cell_w - pattern.shape[1] + 1) for pattern in patterns]
+	all_cell_maps = [np.full((num_images, tray.rows, tray.cols) + map_shape, -np.inf, dtype=np.float32) for map_shape in map_shapes]
+
+	for j, img in enumerate(images):
+		integrals = ImageIntegrals(img) if _canShareMatching(img, patterns, detectors) else None # One image at a time, as they're large.
+		for pattern, detector, cell_maps in zip(patterns, detectors, all_cell_maps):
+			pattern_h, pattern_w = pattern.shape[:2]
+			for (row, col), (x1, y1, x2, y2) in zip(tray, bounds):
+				cell_maps[j, row, col, :y2 - y1 - pattern_h + 1, :x2 - x1 - pattern_w + 1] = matchTemplate(
+					img[y1:y2, x1:x2], pattern, detector.match_method, detector.match_engine, integrals=integrals, origin=(y1, x1))
+
+	for i, (pattern, detector, cell_maps, (map_h, map_w)) in enumerate(zip(patterns, detectors, all_cell_maps, map_shapes)):
+		# Like `SensorDetector._bestMatch`, for every cell of every image.
+		cell_maps = cell_maps.reshape(num_images, tray.rows, tray.cols, -1)
+		best = np.argmax(cell_maps, axis=3)
+		best_scores = np.take_along_axis(cell_maps, best[..., np.newaxis], axis=3)[..., 0]
+		offsets = np.stack((best // map_w, best % map_w), axis=-1) # (y, x) from the top-left of the cell.
+
+		found = best_scores > detector.match_threshold
+		scores[:, i] = np.where(found, best_scores, 0)
+		centers[:, i] = np.where(found[..., np.newaxis], np.flip(offsets + np.array(pattern.shape[:2]) // 2, axis=-1), -1)
+
+	# Same as `combineResults`, for every image.
+	best_matches = np.where(np.amax(scores, axis=1) > 0, np.argmax(scores, axis=1), -1)
+
+	return best_matches, scores, centers
+
+
+def _canShareMatching(img, patterns, detectors):
+	"""Returns True if every detector opted in to `matching.matchTemplateShared` (the `"shared"` engine), so the cells' window statistics can be shared."""
+	if not isinstance(img, np.ndarray): # e.g. LazyWarpedImage, whose regions are warped when read; the detectors then match cells on their own.
+		return False
+	if img.ndim != 2 or any(pattern.ndim != 2 for pattern in patterns):
+		return False
+	return all(detector.match_engine == "shared" and detector.match_method == cv2.TM_CCOEFF_NORMED for detector in detectors)
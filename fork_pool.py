@@ -0,0 +1,120 @@
+"""This module provides a process pool whose workers are forked from a parent that has already loaded everything, so starting (or restarting) workers is nearly free.
+
+The parent imports OpenCV/sklearn, parses the parameters and trays, and loads and thresholds the patterns once, in a `Pipeline`.
+Forked workers inherit that `Pipeline` copy-on-write: its pages are shared with the parent until written to, so each extra worker costs
+little memory for the shared state. `gc.freeze` keeps the garbage collector from writing to (and so copying) the inherited objects.
+
+Note:
+    Requires the `fork` start method, i.e. not Windows. Create the pool before starting any threads in the parent (e.g. `AsyncPipeline` or
+    the `"tiled"` match engine), since only the forking thread exists in the workers.
+
+Usage::
+
+    with ForkPool(params, tray, processes=8) as pool:
+        for best_matches, results in pool.mapPaths(paths):
+            ...
+"""
+import gc
+import multiprocessing
+import os
+
+import cv2
+
+from find_sensors import loadImage
+from pipeline import Pipeline
+
+
+_pipeline = None # Set in the parent before forking, and inherited by the workers.
+
+
+class ForkPool:
+	"""A pool of worker processes sharing one pre-loaded `Pipeline`.
+
+	Attributes:
+	    processes (int): Number of worker processes.
+	    pipeline (pipeline.Pipeline): The pipeline the workers were forked with.
+
+	Args:
+	    params (yaml_config.YAMLDict): Data loaded from `parameters.yml`.
+	    tray (tray.TrayDefinition): Tray definition.
+	    processes (int, optional): See attributes. Defaults to the number of CPUs.
+	    lazy_warp (bool, optional): Passed to `Pipeline`.
+	"""
+	def __init__(self, params, tray, processes=None, lazy_warp=False):
+		if "fork" not in multiprocessing.get_all_start_methods():
+			raise RuntimeError("ForkPool requires the 'fork' start method, which isn't available on this platform.")
+		self._context = multiprocessing.get_context("fork")
+		self.processes = processes or os.cpu_count() or 1
+		self.pipeline = None
+		self._pool = None
+		self._old_pools = [] # Pools replaced by `reload`, finishing their tasks; joined by `close`.
+		self.reload(params, tray, lazy_warp)
+
+	def reload(self, params, tray, lazy_warp=False):
+		"""Loads a new `Pipeline` (e.g. after a config change) and forks new workers with it.
+		Tasks already given to the old workers are finished by them; new tasks go to the new workers."""
+		global _pipeline
+		pipeline = Pipeline(params, tray, lazy_warp)
+
+		if hasattr(gc, "freeze"): # Python 3.7+
+			gc.unfreeze()
+		_pipeline = self.pipeline = pipeline
+		if hasattr(gc, "freeze"):
+			gc.collect()
+			gc.freeze()
+
+		old_pool, self._pool = self._pool, self._context.Pool(self.processes, initializer=_initWorker)
+		if old_pool is not None:
+			old_pool.close()
+			self._old_pools.append(old_pool)
+
+	def process(self, img):
+		"""Processes one image in a worker. Returns the same as `Pipeline.process`, without the calibrated image (see `map`)."""
+		return self._pool.apply(_process, (img,))
+
+	def map(self, images, chunksize=1):
+		"""Processes images in the workers, and returns an iterator over their outputs, in order.
+
+		Args:
+		    images (iterable): Uncalibrated images. Each is copied to a worker.
+		    chunksize (int, optional): Number of images sent to a worker at a time.
+
+		Returns:
+		    iterator: `(best_matches, results)` for each image, as returned by `Pipeline.process`, or None if calibration failed.
+		        The calibrated image isn't sent back, to avoid copying it between processes.
+		"""
+		return self._pool.imap(_process, images, chunksize)
+
+	def mapPaths(self, paths, chunksize=1):
+		"""Like `map`, but the images are loaded by the workers (with the scale/color from `params.image`), so only the paths are copied."""
+		return self._pool.imap(_processPath, paths, chunksize)
+
+	def close(self):
+		"""Waits for the workers (including those replaced by `reload`) to finish their tasks, and stops them."""
+		self._pool.close()
+		for pool in self._old_pools + [self._pool]:
+			pool.join()
+		self._old_pools = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+
+def _initWorker():
+	# Parallelism comes from the processes; OpenCV's own threads would only compete with the other workers.
+	cv2.setNumThreads(1)
+
+
+def _process(img):
+	output = _pipeline.process(img)
+	if output is None:
+		return
+	return output[1], output[2]
+
+
+def _processPath(path):
+	options = {name: value for name, value in _pipeline.params.image.items() if name != "path"}
+	return _process(loadImage(path, **options))
@@ -0,0 +1,227 @@
+"""This module provides a ring buffer of frames in shared memory, so that an acquisition process can hand frames to detection processes without copying or pickling them.
+
+Usage (requires Python 3.8+ for `multiprocessing.shared_memory`)::
+
+    # Acquisition process:
+    ring = FrameRing.create(slots=8, shape=(2048, 2448), dtype=np.uint8)
+    while True:
+        ring.write(camera.grab())
+
+    # Detection process(es), given ring.name:
+    ring = FrameRing.attach(name)
+    for seq, frame in ring.frames():
+        output = pipeline.process(frame)
+        if not ring.isValid(seq):
+            ... # The frame was overwritten while it was being processed; discard the output.
+"""
+import logging
+import os
+import sys
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+from time import sleep
+
+import numpy as np
+
+
+_MAGIC = 0x46524D52494E4731 # "FRMRING1"
+_MAX_DIMS = 4
+_DTYPE_BYTES = 16
+_ALIGNMENT = 64
+
+# Header layout (int64): magic, slots, ndim, shape[_MAX_DIMS], next_seq. Then the dtype string, then one sequence number per slot.
+_HEADER_INTS = 4 + _MAX_DIMS
+_NEXT_SEQ = _HEADER_INTS - 1
+_EMPTY = -1
+
+
+class FrameRing:
+	"""A fixed number of frame slots in one shared memory block, written in turn by a single writer.
+
+	Every frame written gets the next sequence number, and goes into slot `seq % slots`, overwriting the oldest frame.
+	The writer never waits for readers: a reader that falls more than `slots` frames behind loses frames (and is told so).
+
+	Note:
+	    Use `create` in the writer and `attach` in readers, rather than constructing directly.
+	    Frames returned to readers are read-only views into shared memory, valid only until the writer wraps around to the same slot;
+	    check `isValid(seq)` after processing a frame to make sure it wasn't overwritten in the meantime.
+
+	Attributes:
+	    name (str): Name of the shared memory block, to pass to `attach` in other processes.
+	    slots (int): Number of frame slots.
+	    shape (tuple): Shape of each frame.
+	    dtype (numpy.dtype): dtype of each frame.
+	"""
+	def __init__(self, shm, owner):
+		self._shm = shm
+		self._owner = owner
+		self.name = shm.name
+
+		header = np.ndarray((_HEADER_INTS,), dtype=np.int64, buffer=shm.buf)
+		if header[0] != _MAGIC:
+			raise ValueError("Shared memory block %s is not a FrameRing." %shm.name)
+
+		self.slots = int(header[1])
+		self.shape = tuple(int(d) for d in header[3:3 + header[2]])
+		dtype_bytes = bytes(shm.buf[header.nbytes:header.nbytes + _DTYPE_BYTES])
+		self.dtype = np.dtype(dtype_bytes.rstrip(b"\0").decode("ascii"))
+
+		self._header = header
+		self._slot_seqs = np.ndarray((self.slots,), dtype=np.int64, buffer=shm.buf, offset=header.nbytes + _DTYPE_BYTES)
+		self._frames = np.ndarray((self.slots,) + self.shape, dtype=self.dtype, buffer=shm.buf, offset=_dataOffset(self.slots))
+
+	@classmethod
+	def create(cls, slots, shape, dtype=np.uint8, name=None):
+		"""Creates a new shared memory block for the ring. Called by the writer.
+
+		Args:
+		    slots (int): Number of frame slots. Should be more than the number of frames being processed at any one time.
+		    shape (tuple): Shape of each frame, e.g. `(height, width)` or `(height, width, 3)`.
+		    dtype (numpy.dtype, optional): dtype of each frame.
+		    name (str, optional): Name of the shared memory block. If not provided, a unique name is generated.
+
+		Returns:
+		    FrameRing: The new ring, with no frames in it.
+		"""
+		dtype = np.dtype(dtype)
+		if len(shape) > _MAX_DIMS:
+			raise ValueError("Frames can have at most %d dimensions." %_MAX_DIMS)
+
+		size = _dataOffset(slots) + slots * int(np.prod(shape)) * dtype.itemsize
+		shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+		header = np.ndarray((_HEADER_INTS,), dtype=np.int64, buffer=shm.buf)
+		header[:] = 0
+		header[0] = _MAGIC
+		header[1] = slots
+		header[2] = len(shape)
+		header[3:3 + len(shape)] = shape
+		dtype_str = dtype.str.encode("ascii")
+		shm.buf[header.nbytes:header.nbytes + _DTYPE_BYTES] = dtype_str.ljust(_DTYPE_BYTES, b"\0")
+		np.ndarray((slots,), dtype=np.int64, buffer=shm.buf, offset=header.nbytes + _DTYPE_BYTES)[:] = _EMPTY
+
+		return cls(shm, owner=True)
+
+	@classmethod
+	def attach(cls, name):
+		"""Attaches to a ring created (by another process) with `create`. Called by readers.
+
+		Args:
+		    name (str): The ring's `name`.
+
+		Returns:
+		    FrameRing: The existing ring.
+		"""
+		if sys.version_info >= (3, 13):
+			shm = shared_memory.SharedMemory(name=name, track=False)
+		else:
+			# Before Python 3.13, attaching registers the block with this process's resource tracker, which would destroy it when this process exits.
+			shm = shared_memory.SharedMemory(name=name)
+			if os.name == "posix":
+				resource_tracker.unregister(shm._name, "shared_memory")
+		return cls(shm, owner=False)
+
+	@property
+	def next_seq(self):
+		"""The sequence number the next frame written will get."""
+		return int(self._header[_NEXT_SEQ])
+
+	def write(self, frame):
+		"""Copies a frame into the next slot. Called by the writer.
+
+		Args:
+		    frame (numpy.ndarray): Frame of the ring's shape. Converted to the ring's dtype if necessary.
+
+		Returns:
+		    int: The frame's sequence number.
+		"""
+		seq = self.next_seq
+		slot = seq % self.slots
+
+		self._slot_seqs[slot] = _EMPTY # Mark the slot as being written, so that readers don't use a half-written frame.
+		np.copyto(self._frames[slot], frame, casting="unsafe")
+		self._slot_seqs[slot] = seq
+		self._header[_NEXT_SEQ] = seq + 1
+
+		return seq
+
+	def read(self, seq):
+		"""Returns the frame with the given sequence number, as a read-only view into shared memory (no copy).
+
+		Args:
+		    seq (int): Sequence number returned by `write`.
+
+		Returns:
+		    numpy.ndarray: The frame, or None if it hasn't been written yet or has already been overwritten.
+		"""
+		if not self.isValid(seq):
+			return None
+		frame = self._frames[seq % self.slots]
+		frame.flags.writeable = False
+		return frame
+
+	def isValid(self, seq):
+		"""Returns True if the frame with the given sequence number is (still) in the ring."""
+		return int(self._slot_seqs[seq % self.slots]) == seq
+
+	def latest(self):
+		"""Returns `(seq, frame)` for the most recently written frame, or None if no frames have been written."""
+		seq = self.next_seq - 1
+		if seq < 0:
+			return None
+		frame = self.read(seq)
+		if frame is None:
+			return None
+		return seq, frame
+
+	def frames(self, start=None, stride=1, poll_interval=0.001):
+		"""Generator yielding `(seq, frame)` for every frame in order, waiting for new frames as necessary.
+
+		Args:
+		    start (int, optional): Sequence number of the first frame. Defaults to the next frame written.
+		    stride (int, optional): Yield every `stride`th frame. With N workers, worker i uses `start=first + i, stride=N` so that each frame goes to exactly one worker.
+		    poll_interval (float, optional): Seconds to sleep between checks for a new frame.
+
+		Yields:
+		    (int, numpy.ndarray): Sequence number and read-only frame view.
+		"""
+		seq = self.next_seq if start is None else start
+		while True:
+			if seq >= self.next_seq:
+				sleep(poll_interval)
+				continue
+
+			frame = self.read(seq)
+			if frame is None:
+				# The writer has lapped this reader; skip ahead to the oldest frame still in the ring.
+				oldest = max(self.next_seq - self.slots + 1, 0)
+				skipped = -(-(oldest - seq) // stride) * stride
+				logging.warning("FrameRing: reader fell behind, skipping %d frames." %skipped)
+				seq += max(skipped, stride)
+				continue
+
+			yield seq, frame
+			seq += stride
+
+	def close(self):
+		"""Releases this process's views of the shared memory. The writer also destroys the block."""
+		self._header = self._slot_seqs = self._frames = None
+		self._shm.close()
+		if self._owner:
+			if sys.version_info < (3, 13) and os.name == "posix":
+				# A reader forked (or spawned) from this process shares its resource tracker, and unregistering in `attach` removed the block from it.
+				# Register it again, so that unlinking (which unregisters it) doesn't make the tracker report an unknown block.
+				resource_tracker.register(self._shm._name, "shared_memory")
+			self._shm.unlink()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+
+def _dataOffset(slots):
+	"""Returns the byte offset of the first frame, after the header and slot sequence numbers (aligned)."""
+	offset = _HEADER_INTS * 8 + _DTYPE_BYTES + slots * 8
+	return -(-offset // _ALIGNMENT) * _ALIGNMENT
@@ -0,0 +1,184 @@
+"""This module captures frames that take too long to process, so that they can be replayed and profiled later (see `main_replay.py`).
+
+A bundle is a directory containing everything needed to re-run the frame deterministically:
+    * `input.png`: The image exactly as it was passed to `Pipeline.process` (lossless).
+    * `params.yml`: The effective parameters, with pattern paths pointing at copies of the patterns in `patterns/`.
+    * `tray.yml`: The tray definition.
+    * `meta.yml`: Per-stage and total timings, the threshold, library versions, and the `Pipeline` options (`lazy_warp`, and the `map_store` settings, if any).
+    * `profile.prof`: `cProfile` stats for the frame (only if profiling was enabled).
+"""
+import cProfile
+import logging
+import os
+import platform
+import pstats
+import shutil
+import sys
+from datetime import datetime
+from time import perf_counter
+
+import cv2
+import numpy as np
+import yaml
+
+from map_store import MatchMapStore
+from pipeline import Pipeline
+from tray import TrayRegistry
+from yaml_config import loadYAML
+from yaml_config import thaw
+
+
+class Watchdog:
+	"""Wraps `Pipeline.process`, and saves a bundle for every frame that exceeds a latency threshold.
+
+	Attributes:
+	    pipeline (pipeline.Pipeline): The wrapped pipeline.
+	    threshold_ms (float): Frames that take longer than this are captured.
+	    bundle_dir (str): Directory in which bundles are created.
+	    profile (bool): If True, every frame is run under `cProfile`, so that slow frames come with a profile.
+	        This slows down the Python parts of the pipeline noticeably; the OpenCV calls are unaffected.
+	    max_bundles (int): Stop capturing after this many bundles, so a systematic slowdown can't fill the disk.
+	    captured (int): Number of bundles saved so far.
+	"""
+	def __init__(self, pipeline, threshold_ms, bundle_dir="slow_frames", profile=False, max_bundles=100):
+		self.pipeline = pipeline
+		self.threshold_ms = threshold_ms
+		self.bundle_dir = bundle_dir
+		self.profile = profile
+		self.max_bundles = max_bundles
+		self.captured = 0
+
+	def process(self, img, pool=None):
+		"""Same as `Pipeline.process`, capturing a bundle if it takes longer than `threshold_ms`."""
+		timings = {}
+		profiler = cProfile.Profile() if self.profile else None
+
+		t0 = perf_counter()
+		if profiler is not None:
+			profiler.enable()
+		try:
+			output = self.pipeline.process(img, pool, timings)
+		finally:
+			if profiler is not None:
+				profiler.disable()
+		total_ms = (perf_counter() - t0) * 1000
+
+		if total_ms > self.threshold_ms and self.captured < self.max_bundles:
+			try:
+				path = saveBundle(self.bundle_dir, img, self.pipeline, timings, total_ms, profiler, threshold_ms=self.threshold_ms)
+				self.captured += 1
+				logging.warning("Frame took %.1f ms (threshold %.1f ms); saved to %s" %(total_ms, self.threshold_ms, path))
+			except Exception:
+				logging.exception("Failed to save slow frame bundle.")
+
+		return output
+
+
+def saveBundle(bundle_dir, img, pipeline, timings, total_ms, profiler=None, **meta):
+	"""Saves a bundle (see the module docstring) and returns its path.
+
+	Args:
+	    bundle_dir (str): Directory in which to create the bundle.
+	    img (numpy.ndarray): Image passed to `Pipeline.process`.
+	    pipeline (pipeline.Pipeline): The pipeline that processed it.
+	    timings (dict): Per-stage timings from `Pipeline.process`.
+	    total_ms (float): Total milliseconds taken.
+	    profiler (cProfile.Profile, optional): Profiler that ran while the frame was processed.
+	    **meta: Additional entries for `meta.yml`.
+	"""
+	name = "%s_%dms" %(datetime.now().strftime("%Y%m%d-%H%M%S-%f"), total_ms)
+	path = os.path.join(bundle_dir, name)
+	os.makedirs(os.path.join(path, "patterns"))
+
+	cv2.imwrite(os.path.join(path, "input.png"), img)
+
+	# Copy the patterns into the bundle, so that the replay doesn't depend on files that may since have changed.
+	params = thaw(pipeline.params)
+	pattern_params = [params["calibration_detector"]["pattern"]] + [detector_params["pattern"] for detector_params in params["sensor_detectors"]]
+	for index, pattern in enumerate(pattern_params):
+		filename = "%d_%s" %(index, os.path.basename(pattern["path"]))
+		shutil.copyfile(pattern["path"], os.path.join(path, "patterns", filename))
+		pattern["path"] = os.path.join("patterns", filename)
+
+	_dumpYAML(os.path.join(path, "params.yml"), params)
+	_dumpYAML(os.path.join(path, "tray.yml"), [thaw(pipeline.tray.data)])
+
+	meta.update({
+		"total_ms": total_ms,
+		"timings": timings,
+		"image_shape": list(img.shape),
+		"image_dtype": str(img.dtype),
+		"versions": {"python": platform.python_version(), "opencv": cv2.__version__, "numpy": np.__version__},
+		"opencv_threads": cv2.getNumThreads(),
+		"pipeline": {"lazy_warp": bool(pipeline.lazy_warp), "map_store": _mapStoreSettings(pipeline.map_store)},
+	})
+	_dumpYAML(os.path.join(path, "meta.yml"), meta)
+
+	if profiler is not None:
+		profiler.dump_stats(os.path.join(path, "profile.prof"))
+
+	return path
+
+
+def replayBundle(path, profile=True, runs=1):
+	"""Re-runs a bundle saved by `saveBundle`, with a `Pipeline` created with the recorded options (`lazy_warp`, and a new, empty `map_store` with the recorded settings).
+
+	Args:
+	    path (str): Path to the bundle directory.
+	    profile (bool, optional): If True, runs under `cProfile` and saves the stats to `replay.prof` in the bundle.
+	    runs (int, optional): Number of times to run the frame.
+
+	Returns:
+	    dict: `"timings"` (per-stage timings of the last run), `"total_ms"` (list, one per run), `"recorded"` (the contents of `meta.yml`),
+	        `"output"` (the output of `Pipeline.process`), and `"stats"` (`pstats.Stats`, or None).
+	"""
+	recorded = loadYAML(os.path.join(path, "meta.yml"), frozen=True)
+	cv2.setNumThreads(recorded.opencv_threads)
+
+	params = thaw(loadYAML(os.path.join(path, "params.yml")))
+	pattern_params = [params["calibration_detector"]["pattern"]] + [detector_params["pattern"] for detector_params in params["sensor_detectors"]]
+	for pattern in pattern_params:
+		pattern["path"] = os.path.join(path, pattern["path"])
+
+	registry = TrayRegistry(os.path.join(path, "tray.yml"))
+	tray = registry.get(params["tray"]["name"], params["tray"].get("scale", 1))
+	options = recorded.get("pipeline", {}) # Not recorded in older bundles.
+	map_store = MatchMapStore(**options["map_store"]) if options.get("map_store") else None # A new, empty store with the same settings.
+	pipeline = Pipeline(params, tray, lazy_warp=options.get("lazy_warp", False), map_store=map_store)
+
+	img = cv2.imread(os.path.join(path, "input.png"), cv2.IMREAD_UNCHANGED)
+	if img is None:
+		raise FileNotFoundError("No input.png in bundle: " + path)
+
+	profiler = cProfile.Profile() if profile else None
+	total_ms = []
+	for _ in range(runs):
+		timings = {}
+		t0 = perf_counter()
+		if profiler is not None:
+			profiler.enable()
+		try:
+			output = pipeline.process(img, timings=timings)
+		finally:
+			if profiler is not None:
+				profiler.disable()
+		total_ms.append((perf_counter() - t0) * 1000)
+
+	stats = None
+	if profiler is not None:
+		profiler.dump_stats(os.path.join(path, "replay.prof"))
+		stats = pstats.Stats(profiler, stream=sys.stdout)
+
+	return {"timings": timings, "total_ms": total_ms, "recorded": recorded, "output": output, "stats": stats}
+
+
+def _mapStoreSettings(store):
+	"""Returns the settings needed to recreate a `MatchMapStore` (not its contents), or None."""
+	if store is None:
+		return
+	return {"max_bytes": store.max_bytes, "dtype": store.dtype, "level": store.level}
+
+
+def _dumpYAML(path, obj):
+	with open(path, "w") as file:
+		yaml.safe_dump(obj, file, default_flow_style=False)
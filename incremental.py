@@ -0,0 +1,99 @@
+"""This module provides an incremental alternative to `find_sensors.detectSensors`, for continuously monitoring a tray that sits under the camera.
+Only the cells whose pixels changed since they were last searched are passed through `SensorDetector` again; every other cell reuses its earlier result."""
+import logging
+
+import cv2
+import numpy as np
+
+from detector import SensorDetector
+from find_sensors import combineResults
+from find_sensors import loadImage
+
+
+class IncrementalSensorDetector:
+	"""Keeps the calibrated image and per-cell results of previous frames, and re-detects only the cells that changed.
+
+	Each cell is compared against the pixels it had when it was last searched (not the previous frame), so slow drift
+	below `change_threshold` eventually accumulates into a change and is picked up.
+
+	Attributes:
+	    change_threshold (float): Mean absolute pixel difference (0..255) above which a cell is considered changed.
+	    changed_cells (list): (row, col) of the cells that were re-detected by the last call to `detect`.
+
+	Args:
+	    params (yaml_config.YAMLDict): Data loaded from `parameters.yml`.
+	    tray (tray.TrayDefinition): `TrayDefinition` object which determines the number and size of cells in the tray.
+	    change_threshold (float, optional): Overrides `params.incremental.change_threshold`.
+	"""
+	def __init__(self, params, tray, change_threshold=None):
+		if change_threshold is None:
+			change_threshold = params.incremental.change_threshold
+		self.change_threshold = change_threshold
+		self.changed_cells = []
+
+		self._tray = tray
+
+		# Load the patterns and create the detectors once, rather than on every frame.
+		self._detectors = []
+		self._patterns = []
+		for detector_params in params.sensor_detectors:
+			self._patterns.append(loadImage(**detector_params.pattern))
+			self._detectors.append(SensorDetector(**detector_params.detector))
+
+		self.reset()
+
+	def reset(self):
+		"""Forgets the previous frame, so that the next call to `detect` searches every cell."""
+		self._reference = None
+		self._best_matches = None
+		self._results = None
+
+	def detect(self, img):
+		"""Given a calibrated image, finds which tray cells contain sensors, re-using earlier results for cells that haven't changed.
+
+		Args:
+		    img (numpy.ndarray): Transformed image of the tray.
+
+		Returns:
+		    numpy.ndarray: Same as `find_sensors.detectSensors`.
+		    list: Same as `find_sensors.detectSensors`.
+		"""
+		if self._reference is None or self._reference.shape != img.shape:
+			# Nothing to compare against: search every cell.
+			self.changed_cells = list(self._tray)
+			self._reference = img.copy()
+			previous_results = [None] * len(self._detectors)
+		else:
+			self.changed_cells = self.getChangedCells(img)
+			if not self.changed_cells:
+				return self._best_matches, self._results
+
+			# Update the reference pixels of only the cells being re-detected.
+			for row, col in self.changed_cells:
+				x1, y1, x2, y2 = self._tray.getBounds(row, col)
+				self._reference[y1:y2, x1:x2] = img[y1:y2, x1:x2]
+			previous_results = self._results
+
+		logging.debug("Re-detecting %d out of %d cells." %(len(self.changed_cells), self._tray.rows * self._tray.cols))
+
+		results = []
+		for detector, pattern, previous in zip(self._detectors, self._patterns, previous_results):
+			result = detector.detect(img, pattern, self._tray, cells=self.changed_cells, previous=previous)
+			results.append(result)
+
+		self._best_matches = combineResults(results)
+		self._results = results
+
+		return self._best_matches, self._results
+
+	def getChangedCells(self, img):
+		"""Returns a list of (row, col) for each cell whose mean absolute difference from the reference image exceeds `change_threshold`."""
+		diff = cv2.absdiff(img, self._reference)
+
+		changed_cells = []
+		for row, col in self._tray:
+			cell = self._tray.getCell(diff, row, col)
+			if np.mean(cell) > self.change_threshold:
+				changed_cells.append((row, col))
+
+		return changed_cells
@@ -0,0 +1,174 @@
+"""This module picks the image/tray scales automatically to meet a target latency per tray, instead of hand-tuning `image.scale`, `tray.scale` and the pattern scales.
+
+Two factors are chosen, and applied to the scales in `parameters.yml` consistently:
+    * `image_factor` multiplies `image.scale` and the calibration pattern's scale (they are matched against each other),
+      along with the pixel-sized calibration parameters (`preprocessing.block_radius`, `clustering_bandwidth`).
+    * `tray_factor` multiplies `tray.scale` and every sensor pattern's scale (they are matched against each other).
+
+Usage::
+
+    budget = LatencyBudget(params, **params.latency_budget)
+    budget.profile(loadImage(params.image.path)) # Or budget.loadBenchmark("benchmark.yml"), measured earlier on the same kind of station.
+    pipeline, output = budget.process(raw_img)
+"""
+import logging
+import threading
+from itertools import product
+from time import perf_counter
+
+import numpy as np
+import yaml
+
+from cvutils import scaleImage
+from pipeline import Pipeline
+from tray import getTrayDef
+from yaml_config import freeze
+from yaml_config import thaw
+
+
+def scaleParams(params, image_factor=1, tray_factor=1):
+	"""Returns a frozen copy of params, with all scales (and pixel-sized parameters) multiplied by the given factors. See the module docstring."""
+	params = thaw(params)
+
+	params["image"]["scale"] *= image_factor
+	calibration = params["calibration_detector"]
+	calibration["pattern"]["scale"] = calibration["pattern"].get("scale", 1) * image_factor
+	if "block_radius" in calibration["preprocessing"]:
+		calibration["preprocessing"]["block_radius"] = max(1, int(round(calibration["preprocessing"]["block_radius"] * image_factor)))
+	if "clustering_bandwidth" in calibration["detector"]:
+		calibration["detector"]["clustering_bandwidth"] *= image_factor
+
+	params["tray"]["scale"] = params["tray"].get("scale", 1) * tray_factor
+	for detector_params in params["sensor_detectors"]:
+		detector_params["pattern"]["scale"] = detector_params["pattern"].get("scale", 1) * tray_factor
+
+	return freeze(params)
+
+
+class LatencyBudget:
+	"""Chooses the largest scales whose measured latency fits in a target, and adapts if the observed latency drifts.
+
+	Attributes:
+	    target_ms (float): Target milliseconds per tray.
+	    levels (list): Candidate `(image_factor, tray_factor)` pairs, largest (most accurate) first.
+	    expected_ms (dict): Profiled milliseconds per tray for each level.
+	    level (tuple): The `(image_factor, tray_factor)` currently in use.
+
+	Args:
+	    params (yaml_config.YAMLDict): Data loaded from `parameters.yml`, i.e. the scales at factor 1.
+	    target_ms (float): See attributes.
+	    factors (iterable, optional): Candidate values for both factors. All combinations are considered.
+	    smoothing (float, optional): Weight of each new observation in the running average of observed/expected latency.
+	    headroom (float, optional): Moving up to a larger level requires its predicted latency to fit in `target_ms * headroom`, to avoid flip-flopping.
+	    registry (tray.TrayRegistry, optional): Passed to `getTrayDef`.
+	"""
+	def __init__(self, params, target_ms, factors=(1, 0.75, 0.5), smoothing=0.2, headroom=0.85, registry=None):
+		self.params = freeze(params)
+		self.target_ms = target_ms
+		self.smoothing = smoothing
+		self.headroom = headroom
+		self.registry = registry
+
+		# Largest first: by total pixels processed, then by tray factor (sensor detection accuracy).
+		self.levels = sorted(product(factors, factors), key=lambda level: (level[0] * level[1], level[1]), reverse=True)
+		self.expected_ms = {}
+		self.level = self.levels[0]
+
+		self._ratio = 1.0 # Running average of observed / expected latency.
+		self._pipelines = {}
+		self._lock = threading.Lock()
+
+	def pipeline(self, level=None):
+		"""Returns the `Pipeline` for a level (default: the current level), creating it the first time."""
+		if level is None:
+			level = self.level
+		with self._lock:
+			pipeline = self._pipelines.get(level)
+			if pipeline is None:
+				params = scaleParams(self.params, *level)
+				pipeline = Pipeline(params, getTrayDef(**params.tray, registry=self.registry))
+				self._pipelines[level] = pipeline
+		return pipeline
+
+	def profile(self, raw_img, runs=3):
+		"""Measures the latency of every level on a sample image, and selects a level.
+
+		Args:
+		    raw_img (numpy.ndarray): Sample image, loaded at scale 1.
+		    runs (int, optional): The median of this many runs is used for each level.
+		"""
+		for level in self.levels:
+			pipeline = self.pipeline(level)
+			times = []
+			for _ in range(runs):
+				# Timed the same way as `process`, including scaling the image, so that observed and expected latencies are comparable.
+				t0 = perf_counter()
+				pipeline.process(self._scaleImage(raw_img, pipeline))
+				times.append((perf_counter() - t0) * 1000)
+			self.expected_ms[level] = float(np.median(times))
+			logging.debug("LatencyBudget: image x%g, tray x%g: %.1f ms" %(level + (self.expected_ms[level],)))
+
+		self._ratio = 1.0
+		self.level = self._select()
+		logging.info("LatencyBudget: selected image x%g, tray x%g for a %g ms target." %(self.level + (self.target_ms,)))
+
+	def loadBenchmark(self, path):
+		"""Loads latencies saved by `saveBenchmark` instead of profiling, and selects a level."""
+		with open(path) as file:
+			for entry in yaml.safe_load(file):
+				self.expected_ms[(entry["image_factor"], entry["tray_factor"])] = entry["ms"]
+		self.levels = [level for level in self.levels if level in self.expected_ms]
+		self._ratio = 1.0
+		self.level = self._select()
+
+	def saveBenchmark(self, path):
+		"""Saves the profiled latencies, to be loaded with `loadBenchmark` on stations with the same hardware."""
+		entries = [{"image_factor": level[0], "tray_factor": level[1], "ms": ms} for level, ms in self.expected_ms.items()]
+		with open(path, "w") as file:
+			yaml.safe_dump(entries, file)
+
+	def process(self, raw_img, pool=None):
+		"""Scales the image for the current level and processes it, then adapts the level to the observed latency.
+
+		Args:
+		    raw_img (numpy.ndarray): Image, loaded at scale 1.
+		    pool (buffer_pool.BufferPool, optional): Passed to `Pipeline.process`.
+
+		Returns:
+		    pipeline.Pipeline: The pipeline that was used. Its `tray` (and `params`) give the scale of the output.
+		    tuple: Output of `Pipeline.process`.
+		"""
+		level = self.level
+		pipeline = self.pipeline(level)
+
+		t0 = perf_counter()
+		output = pipeline.process(self._scaleImage(raw_img, pipeline), pool)
+		self.observe(level, (perf_counter() - t0) * 1000)
+
+		return pipeline, output
+
+	def observe(self, level, ms):
+		"""Records an observed latency for a level, and changes the current level if the budget is no longer met (or is met with room to spare)."""
+		expected = self.expected_ms.get(level)
+		if not expected:
+			return
+		with self._lock:
+			self._ratio += self.smoothing * (ms / expected - self._ratio)
+			new_level = self._select()
+			if new_level != self.level:
+				logging.info("LatencyBudget: latency is %.2fx the profiled latency; switching to image x%g, tray x%g." %((self._ratio,) + new_level))
+				self.level = new_level
+
+	def _select(self):
+		"""Returns the largest level whose predicted latency fits the target, or the smallest level if none do."""
+		if not self.expected_ms:
+			return self.level
+		current = self.levels.index(self.level) if self.level in self.levels else len(self.levels) - 1
+		for index, level in enumerate(self.levels):
+			limit = self.target_ms if index >= current else self.target_ms * self.headroom
+			if self.expected_ms[level] * self._ratio <= limit:
+				return level
+		return self.levels[-1]
+
+	def _scaleImage(self, raw_img, pipeline):
+		return scaleImage(raw_img, pipeline.params.image.scale)
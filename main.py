@@ -2,6 +2,8 @@
 """Minimum code for full functionality (no GUI). Use this file as a starting point for integrating with ROS."""
 import logging
 
+from buffer_pool import BufferPool
+from buffer_pool import measurePeakMemory
 from find_sensors import calibrate
 from find_sensors import detectSensors
 from find_sensors import loadImage
@@ -18,9 +20,12 @@ def main():
 	tray = getTrayDef(**params.tray)
 	img = loadImage(**params.image)
 
-	# Calibrate image and detect sensors.
-	img = calibrate(img, params, tray)
-	matches, results = detectSensors(img, params, tray)
+	# Calibrate image and detect sensors. When processing a stream of images, keep re-using the same BufferPool.
+	pool = BufferPool()
+	with measurePeakMemory() as memory:
+		img = calibrate(img, params, tray, pool)
+		matches, results = detectSensors(img, params, tray, pool)
+	logging.info("Peak memory: %d bytes (%d bytes held by BufferPool)" %(memory["peak"], pool.nbytes))
 
 	print(matches)
 
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Compares the detection modes in `equivalence.yml` with the reference configuration. Exits with status 1 if any mode exceeds its tolerances."""
+import argparse
+import logging
+import sys
+
+from equivalence import compareModes
+from equivalence import loadCorpus
+from tray import getTrayDef
+from yaml_config import loadYAML
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--config", default="equivalence.yml", help="Modes, corpus and tolerances.")
+	parser.add_argument("--params", default="parameters.yml", help="Reference parameters.")
+	parser.add_argument("--modes", nargs="+", help="Only compare these modes.")
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.WARNING)
+
+	config = loadYAML(args.config)
+	params = loadYAML(args.params)
+	tray = getTrayDef(**params.tray)
+
+	modes = config.modes
+	if args.modes:
+		modes = {name: modes[name] for name in args.modes}
+
+	corpus = loadCorpus(params, config.corpus.get("images", ()), config.corpus.get("synthetic"))
+	if not corpus:
+		parser.error("The corpus is empty.")
+
+	reports = compareModes(params, tray, modes, corpus, config.get("tolerance"))
+
+	print("%-22s %9s %9s %9s %9s %9s %8s %9s %8s" %("mode", "identical", "cells", "center px", "score", "calib px", "failures", "median ms", "speedup"))
+	for name, report in reports.items():
+		print("%-22s %9.3f %9.3f %9.2f %9.4f %9.2f %8d %9.1f %7.2fx  %s" %(
+			name, report["identical"], report["cell_agreement"], report["max_center_px"], report["max_score_delta"],
+			report["max_calibration_px"], report["failures"], report["median_ms"], report["speedup"],
+			"FAIL: " + "; ".join(report["violations"]) if report["violations"] else "ok"))
+
+	if any(report["violations"] for report in reports.values()):
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
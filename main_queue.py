@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Batch processing of archived images across several hosts, through a work queue in a shared SQLite database (see `work_queue`).
+
+    python main_queue.py enqueue queue.db img/archive/*.png   # Coordinator: add images to the queue.
+    python main_queue.py work queue.db                        # On each host (any number of times): process images until the queue is empty.
+    python main_queue.py status queue.db                      # Show progress and throughput.
+"""
+import argparse
+import logging
+
+from find_sensors import loadImage
+from pipeline import Pipeline
+from tray import getTrayDef
+from work_queue import defaultWorkerId
+from work_queue import runWorker
+from work_queue import WorkQueue
+from yaml_config import loadYAML
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	subparsers = parser.add_subparsers(dest="command")
+	subparsers.required = True
+
+	enqueue_parser = subparsers.add_parser("enqueue", help="Add image paths to the queue.")
+	enqueue_parser.add_argument("database")
+	enqueue_parser.add_argument("paths", nargs="+")
+
+	work_parser = subparsers.add_parser("work", help="Process images from the queue until it is empty.")
+	work_parser.add_argument("database")
+	work_parser.add_argument("--params", default="parameters.yml", help="Parameters file.")
+	work_parser.add_argument("--worker-id", default=None, help="Defaults to hostname:pid.")
+	work_parser.add_argument("--max-jobs", type=int, default=None)
+	work_parser.add_argument("--lease", type=float, default=60, help="Lease time in seconds.")
+	work_parser.add_argument("--max-clock-skew", type=float, default=5, help="Largest expected clock difference between hosts, in seconds.")
+
+	status_parser = subparsers.add_parser("status", help="Show progress and throughput.")
+	status_parser.add_argument("database")
+
+	args = parser.parse_args()
+	logging.basicConfig(level=logging.INFO)
+
+	if args.command == "enqueue":
+		queue = WorkQueue(args.database)
+		added = queue.enqueue(args.paths)
+		logging.info("Added %d of %d images." %(added, len(args.paths)))
+
+	elif args.command == "work":
+		queue = WorkQueue(args.database, lease_seconds=args.lease, max_clock_skew=args.max_clock_skew)
+		params = loadYAML(args.params, frozen=True)
+		pipeline = Pipeline(params, getTrayDef(**params.tray))
+		image_options = {name: value for name, value in params.image.items() if name != "path"} # Use the scale/color settings, but not the path.
+
+		worker = args.worker_id or defaultWorkerId()
+		completed = runWorker(queue, pipeline, lambda path: loadImage(path, **image_options), worker, args.max_jobs)
+		logging.info("Worker %s completed %d jobs." %(worker, completed))
+
+	elif args.command == "status":
+		status = WorkQueue(args.database).status()
+		print("pending: %(pending)d  running: %(running)d  done: %(done)d  failed: %(failed)d" %status)
+		print("throughput: %.2f images/s (last 5 min), active workers: %d" %(status["throughput"], len(status["workers"])))
+		if status["eta"] is not None:
+			print("remaining: %d images, about %.0f s" %(status["remaining"], status["eta"]))
+
+
+if __name__ == "__main__":
+	main()
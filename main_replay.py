@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""Replays a slow frame captured by `frame_watchdog.Watchdog`, under the profiler, and compares its timings with the recorded ones."""
+import argparse
+import logging
+
+from frame_watchdog import replayBundle
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("bundle", help="Path to the bundle directory.")
+	parser.add_argument("--runs", type=int, default=1, help="Number of times to run the frame.")
+	parser.add_argument("--no-profile", action="store_true", help="Don't run under cProfile.")
+	parser.add_argument("--top", type=int, default=25, help="Number of functions to show in the profile.")
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.INFO)
+
+	replay = replayBundle(args.bundle, profile=not args.no_profile, runs=args.runs)
+	recorded = replay["recorded"]
+
+	print("%-16s %12s %12s" %("stage", "recorded ms", "replay ms"))
+	for stage, ms in replay["timings"].items():
+		print("%-16s %12.1f %12.1f" %(stage, recorded.timings.get(stage, float("nan")), ms))
+	print("%-16s %12.1f %12s" %("total", recorded.total_ms, ", ".join("%.1f" %ms for ms in replay["total_ms"])))
+
+	if replay["output"] is None:
+		print("Calibration failed.")
+	else:
+		print(replay["output"][1])
+
+	if replay["stats"] is not None:
+		replay["stats"].sort_stats("cumulative").print_stats(args.top)
+
+
+if __name__ == "__main__":
+	main()
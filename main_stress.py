@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Stress test: runs many threads against the same `Pipeline` at once, and checks that every thread gets the same answer as a single-threaded run."""
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+import numpy as np
+
+from buffer_pool import BufferPool
+from find_sensors import loadImage
+from pipeline import Pipeline
+from tray import getTrayDef
+from yaml_config import loadYAML
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--threads", type=int, default=8, help="Number of threads.")
+	parser.add_argument("--iterations", type=int, default=20, help="Number of images processed by each thread.")
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.INFO)
+
+	params = loadYAML("parameters.yml", frozen=True)
+	params_hash = hash(params)
+	tray = getTrayDef(**params.tray)
+	img = loadImage(**params.image)
+	img.flags.writeable = False # Any stage that tries to write to its input will fail loudly.
+
+	pipeline = Pipeline(params, tray)
+
+	# Reference result, single-threaded.
+	_, expected_matches, expected_results = pipeline.process(img)
+
+	def worker(thread_index):
+		pool = BufferPool() # One pool per thread.
+		failures = 0
+		for _ in range(args.iterations):
+			output = pipeline.process(img, pool)
+			if output is None or not _sameResults(output[1], output[2], expected_matches, expected_results):
+				failures += 1
+		return failures
+
+	t0 = time()
+	with ThreadPoolExecutor(args.threads) as executor:
+		failures = sum(executor.map(worker, range(args.threads)))
+	elapsed = time() - t0
+
+	total = args.threads * args.iterations
+	logging.info("%d images on %d threads in %.2fs (%.1f images/s)" %(total, args.threads, elapsed, total / elapsed))
+
+	if hash(params) != params_hash:
+		failures += 1
+		logging.error("Parameters were modified during processing.")
+
+	if failures:
+		logging.error("%d of %d results differed from the single-threaded result." %(failures, total))
+		raise SystemExit(1)
+	logging.info("All results matched.")
+
+
+def _sameResults(matches, results, expected_matches, expected_results):
+	"""Returns True if the output of `Pipeline.process` is identical to the expected output."""
+	if not np.array_equal(matches, expected_matches):
+		return False
+	for result, expected in zip(results, expected_results):
+		if not (np.array_equal(result.scores, expected.scores) and np.array_equal(result.centers, expected.centers)):
+			return False
+	return True
+
+
+if __name__ == "__main__":
+	main()
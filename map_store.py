@@ -0,0 +1,107 @@
+"""This module keeps template matching maps around after detection, compressed, so that a suspicious result can be inspected
+(or re-thresholded) without running the detection again.
+
+Maps are quantized (to uint8 or float16) and zlib-compressed when stored, and only decompressed when read back, through
+`SensorDetectorResult.getMatchMap` (or `CalibrationDetectorResult.match_map`, when calling `CalibrationDetector.detect` directly).
+The store has a byte limit; when it's full, the least recently used maps are evicted, and reading them back gives None.
+
+Usage::
+
+    store = MatchMapStore(max_bytes=64 * 2**20)
+    pipeline = Pipeline(params, tray, map_store=store)
+    img_calibrated, best_matches, results = pipeline.process(img)
+    cell_map = results[0].getMatchMap(0, 0)
+"""
+import itertools
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+class MatchMapStore:
+	"""A size-limited, least-recently-used store of compressed match maps.
+
+	Attributes:
+	    max_bytes (int): Limit on the total compressed size of the stored maps.
+	    dtype (str): `"uint8"` (maps are scaled to 256 levels between their min and max) or `"float16"`.
+	    level (int): zlib compression level.
+	    nbytes (int): Total compressed size of the stored maps.
+	    evictions (int): Number of maps evicted so far.
+
+	Args:
+	    max_bytes (int, optional): See attributes.
+	    dtype (str, optional): See attributes.
+	    level (int, optional): See attributes. Low levels are much faster, and match maps compress well anyway.
+	"""
+	def __init__(self, max_bytes=64 * 2**20, dtype="uint8", level=1):
+		if dtype not in ("uint8", "float16"):
+			raise ValueError("Unknown match map dtype: %s" %dtype)
+		self.max_bytes = max_bytes
+		self.dtype = dtype
+		self.level = level
+		self.nbytes = 0
+		self.evictions = 0
+
+		self._maps = OrderedDict() # Key -> (compressed bytes, shape, offset, scale). Least recently used first.
+		self._keys = itertools.count()
+		self._lock = threading.Lock() # Detectors may store maps from several threads at once.
+
+	def put(self, match_map):
+		"""Quantizes, compresses and stores a match map.
+
+		Returns:
+		    int: Key to read the map back with `get`.
+		"""
+		match_map = np.asarray(match_map, dtype=np.float32)
+		if self.dtype == "uint8":
+			offset = float(match_map.min()) if match_map.size else 0.0
+			scale = (float(match_map.max()) - offset) / 255 if match_map.size else 0.0
+			quantized = np.round((match_map - offset) / scale) if scale else np.zeros(match_map.shape)
+			quantized = quantized.astype(np.uint8)
+		else:
+			offset, scale = 0.0, 1.0
+			quantized = match_map.astype(np.float16)
+		data = zlib.compress(np.ascontiguousarray(quantized).tobytes(), self.level)
+
+		with self._lock:
+			key = next(self._keys)
+			self._maps[key] = (data, match_map.shape, offset, scale)
+			self.nbytes += len(data)
+			while self.nbytes > self.max_bytes and len(self._maps) > 1:
+				_, (evicted, _, _, _) = self._maps.popitem(last=False)
+				self.nbytes -= len(evicted)
+				self.evictions += 1
+		return key
+
+	def get(self, key):
+		"""Decompresses a stored match map.
+
+		Returns:
+		    numpy.ndarray: The float32 map (with quantization error: up to half a level for uint8), or None if it has been evicted.
+		"""
+		with self._lock:
+			entry = self._maps.get(key)
+			if entry is None:
+				return
+			self._maps.move_to_end(key)
+
+		data, shape, offset, scale = entry
+		quantized = np.frombuffer(zlib.decompress(data), dtype=self.dtype).reshape(shape)
+		match_map = quantized.astype(np.float32)
+		if self.dtype == "uint8":
+			match_map *= scale
+			match_map += offset
+		return match_map
+
+	def clear(self):
+		with self._lock:
+			self._maps.clear()
+			self.nbytes = 0
+
+	def __contains__(self, key):
+		return key in self._maps
+
+	def __len__(self):
+		return len(self._maps)
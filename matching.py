@@ -0,0 +1,207 @@
+"""Template matching engines used by the detectors in `detector.py`.
+
+`matchTemplate` dispatches to an engine by name, so that the engine can be selected per detector in `parameters.yml` (`match_engine`):
+    * `"opencv"`: `cv2.matchTemplate`, using the detector's `match_method`.
+    * `"tiled"`: `matchTemplateTiled`, i.e. `cv2.matchTemplate` split into tiles that run in parallel, for large images.
+    * `"shared"`: `matchTemplateShared`, which normalizes with each cell's window statistics, computed once and shared between patterns
+      (`find_sensors.scoreSensors` shares them when every sensor detector selects it). It's slower than `"opencv"`; see `matchTemplateShared`.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+ENGINES = ("opencv", "tiled", "shared")
+
+
+_tile_executors = {} # Thread pool for `matchTemplateTiled`, by number of workers.
+_tile_executors_lock = threading.Lock()
+
+
+def matchTemplate(img, pattern, method=cv2.TM_CCOEFF_NORMED, engine="opencv", result=None, tile_size=None, tile_workers=None, integrals=None, origin=(0, 0)):
+	"""Performs template matching with the given engine.
+
+	Args:
+	    img (numpy.ndarray): Image to search.
+	    pattern (numpy.ndarray): Template to search for.
+	    method (int, optional): `cv2.TM_*` constant. Used by the `"opencv"` and `"tiled"` engines.
+	    engine (str, optional): One of `ENGINES`.
+	    result (numpy.ndarray, optional): float32 output array, e.g. from a `buffer_pool.BufferPool`.
+	    tile_size, tile_workers (optional): Passed to `matchTemplateTiled` by the `"tiled"` engine.
+	    integrals, origin (optional): Passed to `matchTemplateShared` by the `"shared"` engine.
+
+	Returns:
+	    numpy.ndarray: Match map of shape (img_h - pattern_h + 1, img_w - pattern_w + 1).
+	"""
+	if engine == "opencv":
+		return cv2.matchTemplate(img, pattern, method, result=result)
+	elif engine == "tiled":
+		return matchTemplateTiled(img, pattern, method, tile_size, tile_workers, result=result)
+	elif engine == "shared":
+		if method != cv2.TM_CCOEFF_NORMED:
+			raise ValueError("The shared match engine only supports cv2.TM_CCOEFF_NORMED.")
+		return matchTemplateShared(img, pattern, integrals, origin, result=result)
+	else:
+		raise ValueError("Unknown match engine: " + str(engine))
+
+
+def matchTemplateTiled(img, pattern, method=cv2.TM_CCOEFF_NORMED, tile_size=None, workers=None, result=None):
+	"""Same as `cv2.matchTemplate`, but splits the match map into tiles that are computed in parallel on a thread pool (OpenCV releases the GIL).
+
+	Each tile of the match map is computed from the image region under it, which overlaps the neighbouring regions by the pattern size minus 1,
+	so the stitched map covers the same positions as a single `cv2.matchTemplate` call.
+
+	Note:
+	    The scores are not bit-identical: OpenCV correlates each tile separately (often by DFT), so rounding differs slightly (about 1e-4 relative).
+	    Where two neighbouring peaks are nearly tied, the best match can move by a pixel; see the `tiled_calibration` mode in `equivalence.yml`.
+
+	Args:
+	    img (numpy.ndarray): Image to search.
+	    pattern (numpy.ndarray): Template to search for.
+	    method (int, optional): `cv2.TM_*` constant.
+	    tile_size (int, optional): Height and width of each tile of the match map. Images with a match map smaller than one tile are matched in one call.
+	        Defaults to 4 times the pattern's larger side (at least 512), so that the overlap between the tiles' image regions, which is correlated
+	        once per tile, stays under about 1.6x the work of a single call.
+	    workers (int, optional): Number of threads. Defaults to the number of CPUs.
+	    result (numpy.ndarray, optional): float32 output array.
+
+	Returns:
+	    numpy.ndarray: Match map, in the same layout as `cv2.matchTemplate`.
+	"""
+	map_h, map_w = img.shape[0] - pattern.shape[0] + 1, img.shape[1] - pattern.shape[1] + 1
+	if tile_size is None:
+		tile_size = max(512, 4 * max(pattern.shape[:2]))
+	if map_h <= tile_size and map_w <= tile_size:
+		return cv2.matchTemplate(img, pattern, method, result=result)
+
+	if result is None or result.shape != (map_h, map_w) or result.dtype != np.float32:
+		result = np.empty((map_h, map_w), dtype=np.float32)
+
+	pattern_h, pattern_w = pattern.shape[:2]
+
+	def matchTile(origin):
+		y, x = origin
+		tile_h, tile_w = min(tile_size, map_h - y), min(tile_size, map_w - x)
+		region = img[y:y + tile_h + pattern_h - 1, x:x + tile_w + pattern_w - 1]
+		result[y:y + tile_h, x:x + tile_w] = cv2.matchTemplate(region, pattern, method)
+
+	origins = [(y, x) for y in range(0, map_h, tile_size) for x in range(0, map_w, tile_size)]
+	for _ in _tileExecutor(workers).map(matchTile, origins): # Consumed, so that exceptions are raised here.
+		pass
+	return result
+
+
+def _tileExecutor(workers=None):
+	"""Returns the shared thread pool with the given number of workers, creating it the first time."""
+	if workers is None:
+		workers = os.cpu_count() or 1
+	with _tile_executors_lock:
+		executor = _tile_executors.get(workers)
+		if executor is None:
+			executor = ThreadPoolExecutor(workers, thread_name_prefix="matchTemplateTiled")
+			_tile_executors[workers] = executor
+	return executor
+
+
+class ImageIntegrals:
+	"""Window statistics for `matchTemplateShared`, computed from the integral and squared integral images (float64) of regions of one image
+	(e.g. tray cells), and kept so that every pattern of the same size matched against the same region shares them.
+
+	Note:
+	    The integral images are computed per region, when first needed, rather than over the whole image at once, which takes longer than
+	    all the regions together (about 46 ms for a 1600x2640 image, against about 12 ms for its 49 cells).
+	    Create one per image, and use it from one thread at a time.
+
+	Args:
+	    img (numpy.ndarray): Single-channel image.
+	"""
+	def __init__(self, img):
+		if img.ndim != 2:
+			raise ValueError("Shared template matching requires single-channel images.")
+		self.img = img
+		self._integrals = {} # (origin, region shape) -> (sum, squared sum).
+		self._window_stats = {} # (origin, region shape, pattern shape) -> (window sums, window norms).
+
+	def windowStats(self, origin, region_shape, pattern_shape):
+		"""Returns the sum of every window of `pattern_shape` in the region of the image at `origin` (y, x), and the norm of each window about its own mean."""
+		key = origin, region_shape, pattern_shape
+		stats = self._window_stats.get(key)
+		if stats is None:
+			region_sum, region_sqsum = self._regionIntegrals(origin, region_shape)
+			pattern_h, pattern_w = pattern_shape
+			window_sum = _windowSums(region_sum, pattern_h, pattern_w)
+			window_norm = _windowSums(region_sqsum, pattern_h, pattern_w)
+			window_norm -= np.square(window_sum) / (pattern_h * pattern_w)
+			np.maximum(window_norm, 0, out=window_norm)
+			np.sqrt(window_norm, out=window_norm)
+			stats = self._window_stats[key] = window_sum, window_norm
+		return stats
+
+	def _regionIntegrals(self, origin, region_shape):
+		key = origin, region_shape
+		integrals = self._integrals.get(key)
+		if integrals is None:
+			(y, x), (region_h, region_w) = key
+			region = self.img[y:y + region_h, x:x + region_w]
+			integrals = self._integrals[key] = cv2.integral2(region, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+		return integrals
+
+
+def matchTemplateShared(img, pattern, integrals=None, origin=(0, 0), result=None):
+	"""Same as `cv2.matchTemplate(img, pattern, cv2.TM_CCOEFF_NORMED)`, but the window statistics that normalize the scores come from
+	an `ImageIntegrals` that can be computed once and shared: between regions (e.g. tray cells) of the same image, and between patterns of the same size.
+
+	Only the cross-correlation (`cv2.TM_CCORR`) is computed per call; the scores are then normalized the same way OpenCV does it.
+
+	Note:
+	    The scores are bit-identical to `cv2.matchTemplate`, but this is slower: OpenCV normalizes in one pass of C code, so its window statistics
+	    were never the expensive part, and computing them with numpy costs more than sharing saves. At production tray scale (1600x2640, 49 cells,
+	    110x160 patterns), `find_sensors.scoreSensors` took about 0.23 s with one pattern and 0.34 s with two, against 0.11 s and 0.27 s with
+	    the `"opencv"` engine. It's kept, opt-in, for comparison in `equivalence.yml`; don't enable it for speed.
+
+	Args:
+	    img (numpy.ndarray): Single-channel image to search.
+	    pattern (numpy.ndarray): Single-channel template to search for, of the same dtype as `img`.
+	    integrals (ImageIntegrals, optional): Of `img`, or of a larger image that `img` is a region of. Computed if not provided.
+	    origin (tuple, optional): (y, x) of the top-left of `img` in the image `integrals` were computed from.
+	    result (numpy.ndarray, optional): float32 output array.
+
+	Returns:
+	    numpy.ndarray: Match map, in the same layout as `cv2.matchTemplate`.
+	"""
+	if img.ndim != 2 or pattern.ndim != 2:
+		raise ValueError("Shared template matching requires single-channel images.")
+	if integrals is None:
+		integrals = ImageIntegrals(img)
+
+	pattern_mean, pattern_std = cv2.meanStdDev(pattern)
+	pattern_norm = float(pattern_std[0, 0]) * np.sqrt(pattern.size)
+
+	result = cv2.matchTemplate(img, pattern, cv2.TM_CCORR, result=result)
+	if pattern_norm < np.finfo(np.float64).eps:
+		result[:] = 1 # A flat pattern matches everywhere, as with cv2.matchTemplate.
+		return result
+
+	# Correlation with the zero-mean pattern, over the pattern's norm times the norm of each window about its own mean.
+	window_sum, window_norm = integrals.windowStats(tuple(origin), img.shape, pattern.shape)
+	numerator = window_sum * -float(pattern_mean[0, 0])
+	numerator += result
+	denominator = window_norm * pattern_norm
+
+	# As in OpenCV: scores just outside [-1..1] from rounding are clamped, and windows too flat for a meaningful score are 0.
+	with np.errstate(divide="ignore", invalid="ignore"):
+		scores = numerator / denominator
+	outside = ~(np.abs(scores) < 1) # Also catches the NaN/inf of flat windows.
+	if np.any(outside):
+		scores[outside] = np.where(np.abs(numerator[outside]) < denominator[outside] * 1.125, np.sign(numerator[outside]), 0)
+	result[:] = scores
+	return result
+
+
+def _windowSums(integral, window_h, window_w):
+	"""Given an integral image, returns the sum of every window of the given size (in the same layout as `cv2.matchTemplate`)."""
+	return (integral[window_h:, window_w:] - integral[:-window_h, window_w:]
+		- integral[window_h:, :-window_w] + integral[:-window_h, :-window_w])
@@ -0,0 +1,140 @@
+"""This module bundles the steps in `find_sensors` into one reusable object, for processing many images with the same parameters and tray."""
+from time import perf_counter
+
+from detector import CalibrationDetector
+from detector import SensorDetector
+from find_sensors import findTransform
+from find_sensors import findTransforms
+from find_sensors import loadCalibrationPattern
+from find_sensors import loadImage
+from find_sensors import scoreSensors
+from find_sensors import scoreSensorsBatch
+from find_sensors import warpImage
+from yaml_config import freeze
+
+
+class Pipeline:
+	"""Loads the patterns and creates the detectors once, then calibrates images and detects sensors with them.
+
+	Note:
+	    Nothing is modified after `__init__` (the params are frozen, and the pattern arrays are read-only), so one `Pipeline`
+	    can be used by any number of threads at once. Each thread must use its own `BufferPool`, if any.
+
+	Attributes:
+	    params (yaml_config.FrozenYAMLDict): Frozen copy of the parameters.
+	    tray (tray.TrayDefinition): Tray which determines the calibrated image size and the cells.
+	    lazy_warp (bool): Whether the calibrated image is warped lazily.
+	    map_store (map_store.MatchMapStore): Store in which the sensor detectors keep their match maps, or None.
+	    calibration_pattern (numpy.ndarray): Thresholded calibration pattern.
+	    calibration_detector (detector.CalibrationDetector): Detector for the calibration points.
+	    sensor_patterns (tuple): Pattern for each type of sensor.
+	    sensor_detectors (tuple): `SensorDetector` for each type of sensor.
+
+	Args:
+	    params (yaml_config.YAMLDict): Data loaded from `parameters.yml`.
+	    tray (tray.TrayDefinition): `TrayDefinition` object, e.g. from `getTrayDef(**params.tray)`.
+	    lazy_warp (bool, optional): If True, the calibrated image is a `transform.LazyWarpedImage`, and only the tray cells are warped.
+	    map_store (map_store.MatchMapStore, optional): If provided, the sensor detectors' match maps are kept in it (see `detector.SensorDetector`),
+	        so that they can be read back from the results. The calibration match map isn't kept: `findTransform` doesn't return the calibration result
+	        it could be read back from, and it's larger than all the cell maps together, so it would only push them out of the store.
+	"""
+	def __init__(self, params, tray, lazy_warp=False, map_store=None):
+		self.params = freeze(params)
+		self.tray = tray
+		self.lazy_warp = lazy_warp
+		self.map_store = map_store
+
+		self.calibration_pattern = _readOnly(loadCalibrationPattern(self.params))
+		self.calibration_detector = CalibrationDetector(**self.params.calibration_detector.detector)
+
+		self.sensor_patterns = tuple(_readOnly(loadImage(**detector_params.pattern)) for detector_params in self.params.sensor_detectors)
+		self.sensor_detectors = tuple(SensorDetector(**detector_params.detector, map_store=map_store) for detector_params in self.params.sensor_detectors)
+
+	def calibrate(self, img, pool=None):
+		"""Same as `find_sensors.calibrate`, using this pipeline's params and tray."""
+		transform = self.findTransform(img, pool)
+		if transform is None:
+			return
+		return warpImage(img, transform, self.tray, pool, self.lazy_warp)
+
+	def findTransform(self, img, pool=None):
+		"""Same as `find_sensors.findTransform`, using this pipeline's params and tray."""
+		return findTransform(img, self.calibration_pattern, self.calibration_detector, self.params.calibration_detector.preprocessing, self.tray, pool)
+
+	def detectSensors(self, img, pool=None):
+		"""Same as `find_sensors.detectSensors`, using this pipeline's params and tray."""
+		return scoreSensors(img, self.sensor_patterns, self.sensor_detectors, self.tray, pool)
+
+	def detectSensorsBatch(self, images):
+		"""Same as `find_sensors.detectSensorsBatch`, using this pipeline's params and tray."""
+		return scoreSensorsBatch(images, self.sensor_patterns, self.sensor_detectors, self.tray)
+
+	def process(self, img, pool=None, timings=None):
+		"""Calibrates the image and detects sensors on it.
+
+		Args:
+		    img (numpy.ndarray): Uncalibrated image.
+		    pool (buffer_pool.BufferPool, optional): See `find_sensors.calibrate`.
+		    timings (dict, optional): If provided, the milliseconds taken by each stage (`"find_transform"`, `"warp"`, `"detect_sensors"`) are stored in it.
+
+		Returns:
+		    numpy.ndarray: The calibrated image.
+		    numpy.ndarray: Same as `find_sensors.detectSensors`.
+		    list: Same as `find_sensors.detectSensors`.
+		    Or None, if calibration failed.
+		"""
+		stopwatch = _Stopwatch(timings)
+
+		transform = self.findTransform(img, pool)
+		stopwatch.lap("find_transform")
+		if transform is None:
+			return
+
+		img_calibrated = warpImage(img, transform, self.tray, pool, self.lazy_warp)
+		stopwatch.lap("warp")
+
+		best_matches, results = self.detectSensors(img_calibrated, pool)
+		stopwatch.lap("detect_sensors")
+
+		return img_calibrated, best_matches, results
+
+	def processMulti(self, img, count, executor=None):
+		"""Like `process`, for an image containing several trays of this pipeline's type. The calibration search is done once for the whole image.
+
+		Args:
+		    img (numpy.ndarray): Uncalibrated image.
+		    count (int): Number of trays in the image.
+		    executor (concurrent.futures.Executor, optional): If provided, the trays are warped and scored in parallel on it (a `ThreadPoolExecutor` works well, as OpenCV releases the GIL).
+
+		Returns:
+		    list: Output of `process` for each tray found, ordered left to right, then top to bottom.
+		"""
+		transforms = findTransforms(img, self.calibration_pattern, self.calibration_detector, self.params.calibration_detector.preprocessing, self.tray, count)
+
+		def processTray(transform):
+			img_calibrated = warpImage(img, transform, self.tray, lazy=self.lazy_warp)
+			best_matches, results = self.detectSensors(img_calibrated)
+			return img_calibrated, best_matches, results
+
+		if executor is None:
+			return [processTray(transform) for transform in transforms]
+		return list(executor.map(processTray, transforms))
+
+
+class _Stopwatch:
+	"""Records the milliseconds between successive calls to `lap` into a dict (or does nothing, if the dict is None)."""
+	def __init__(self, timings):
+		self._timings = timings
+		self._last = perf_counter()
+
+	def lap(self, name):
+		if self._timings is not None:
+			now = perf_counter()
+			self._timings[name] = (now - self._last) * 1000
+			self._last = now
+
+
+def _readOnly(array):
+	"""Marks an array as read-only (so that sharing it between threads is safe), and returns it."""
+	array.flags.writeable = False
+	return array
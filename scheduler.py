@@ -0,0 +1,202 @@
+"""This module schedules images from several workloads (e.g. a live camera and a backfill batch) onto one set of pipeline workers,
+so that a large batch can't starve the live line.
+
+Each job is split into stages: finding the transform, warping, and detecting each type of sensor. After every stage the job goes back into
+the queue, so a waiting job of a higher priority class runs next, i.e. jobs are preempted at stage boundaries. A job whose deadline has
+passed is dropped at its next stage boundary, instead of using up time that another job could still meet its deadline with.
+
+Usage::
+
+    scheduler = Scheduler(pipeline, workers=4)
+    future = scheduler.submit(img, LIVE, deadline=0.1)
+    img_calibrated, best_matches, results = future.result()
+"""
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import CancelledError
+from concurrent.futures import Future
+from time import monotonic
+
+from find_sensors import combineResults
+from find_sensors import scoreSensors
+from find_sensors import warpImage
+
+
+LIVE = 0
+INTERACTIVE = 1
+BATCH = 2
+
+PRIORITY_NAMES = {LIVE: "live", INTERACTIVE: "interactive", BATCH: "batch"}
+
+
+class DeadlineExceeded(Exception):
+	"""Set on a job's future when the job is dropped for missing its deadline."""
+
+
+class Scheduler:
+	"""Runs `Pipeline.process` jobs on worker threads, in order of priority class, then deadline, then submission.
+
+	Note:
+	    Each type of sensor is a separate stage, so sensor detectors using the `"shared"` match engine compute each cell's window statistics
+	    once per type of sensor instead of once per image (see `find_sensors.scoreSensors`). This is the cost of being able to preempt between them.
+
+	Attributes:
+	    pipeline (pipeline.Pipeline): Pipeline used for every job.
+	    counters (dict): For each priority class name, the number of jobs `submitted`, `completed`, `dropped` (missed their deadline),
+	        `failed` (raised an exception), `cancelled`, and `preempted` (number of times a job was made to wait for a higher priority job at a stage boundary).
+
+	Args:
+	    pipeline (pipeline.Pipeline): See attributes.
+	    workers (int, optional): Number of worker threads. OpenCV releases the GIL, so several threads can work at once.
+	"""
+	def __init__(self, pipeline, workers=1):
+		self.pipeline = pipeline
+		self.counters = {name: dict.fromkeys(("submitted", "completed", "dropped", "failed", "cancelled", "preempted"), 0) for name in PRIORITY_NAMES.values()}
+
+		self._queue = [] # Heap of (priority, deadline, sequence number, job).
+		self._sequence = itertools.count()
+		self._condition = threading.Condition()
+		self._shutdown = False
+
+		self._threads = [threading.Thread(target=self._work, name="Scheduler-%d" %i, daemon=True) for i in range(workers)]
+		for thread in self._threads:
+			thread.start()
+
+	def submit(self, img, priority=BATCH, deadline=None):
+		"""Queues an image to be processed.
+
+		Args:
+		    img (numpy.ndarray): Uncalibrated image.
+		    priority (int, optional): `LIVE`, `INTERACTIVE` or `BATCH`.
+		    deadline (float, optional): Seconds from now by which the result is needed. If it passes before the job finishes, the job is dropped.
+
+		Returns:
+		    concurrent.futures.Future: Resolves to the output of `Pipeline.process`, or raises `DeadlineExceeded`.
+		"""
+		if priority not in PRIORITY_NAMES:
+			raise ValueError("Unknown priority: %s" %priority)
+
+		job = _Job(img, priority, None if deadline is None else monotonic() + deadline)
+		with self._condition:
+			if self._shutdown:
+				raise RuntimeError("Cannot submit to a scheduler that has been shut down.")
+			self._counters(job)["submitted"] += 1
+			job.sequence = next(self._sequence)
+			self._push(job)
+		return job.future
+
+	def stats(self):
+		"""Returns a copy of `counters`, plus the number of jobs `queued` in each priority class."""
+		with self._condition:
+			stats = {name: dict(counters, queued=0) for name, counters in self.counters.items()}
+			for _, _, _, job in self._queue:
+				stats[PRIORITY_NAMES[job.priority]]["queued"] += 1
+		return stats
+
+	def shutdown(self, wait=True, cancel_pending=False):
+		"""Stops the workers once the queue is empty (or immediately after their current stage, with `cancel_pending`, cancelling the queued jobs;
+		the futures of queued jobs that had already started raise `concurrent.futures.CancelledError`)."""
+		with self._condition:
+			self._shutdown = True
+			if cancel_pending:
+				for _, _, _, job in self._queue:
+					# A job that has run a stage is already running, so its future can't be cancelled; resolve it with an error instead.
+					if job.stage == 0:
+						job.future.cancel()
+					else:
+						job.future.set_exception(CancelledError("The scheduler was shut down before the job finished."))
+					if job.future.done():
+						self._counters(job)["cancelled"] += 1
+				self._queue.clear()
+			self._condition.notify_all()
+		if wait:
+			for thread in self._threads:
+				thread.join()
+
+	def _push(self, job):
+		# Jobs without a deadline sort after jobs with one, in the same class. The sequence number is kept from submission,
+		# so a re-queued job keeps its place, and jobs of the same class run to completion in order instead of taking turns.
+		deadline = float("inf") if job.deadline is None else job.deadline
+		heapq.heappush(self._queue, (job.priority, deadline, job.sequence, job))
+		self._condition.notify()
+
+	def _counters(self, job):
+		return self.counters[PRIORITY_NAMES[job.priority]]
+
+	def _work(self):
+		while True:
+			with self._condition:
+				while not self._queue and not self._shutdown:
+					self._condition.wait()
+				if not self._queue:
+					return
+				job = heapq.heappop(self._queue)[3]
+
+			if job.stage == 0 and not job.future.set_running_or_notify_cancel():
+				with self._condition:
+					self._counters(job)["cancelled"] += 1
+				continue
+
+			if job.deadline is not None and monotonic() > job.deadline:
+				logging.debug("Scheduler: dropped a %s job at stage %d; its deadline passed." %(PRIORITY_NAMES[job.priority], job.stage))
+				with self._condition:
+					self._counters(job)["dropped"] += 1
+				job.future.set_exception(DeadlineExceeded())
+				continue
+
+			try:
+				done = job.runStage(self.pipeline)
+			except Exception as e:
+				with self._condition:
+					self._counters(job)["failed"] += 1
+				job.future.set_exception(e)
+				continue
+
+			with self._condition:
+				if done:
+					self._counters(job)["completed"] += 1
+				else:
+					if self._queue and self._queue[0][0] < job.priority:
+						self._counters(job)["preempted"] += 1
+					self._push(job)
+			if done:
+				job.future.set_result(job.output)
+
+
+class _Job:
+	"""An image going through `Pipeline.process`, one stage at a time."""
+	def __init__(self, img, priority, deadline):
+		self.img = img
+		self.priority = priority
+		self.deadline = deadline # In `monotonic()` time, or None.
+		self.sequence = None # Order of submission, set by `Scheduler.submit`.
+		self.future = Future()
+
+		self.stage = 0
+		self.output = None
+		self._transform = None
+		self._img_calibrated = None
+		self._results = []
+
+	def runStage(self, pipeline):
+		"""Runs the next stage, and returns True if the job is finished (its output is then in `output`)."""
+		stage = self.stage
+		self.stage += 1
+
+		if stage == 0:
+			self._transform = pipeline.findTransform(self.img)
+			return self._transform is None # Calibration failed: the output is None, like `Pipeline.process`.
+		elif stage == 1:
+			self._img_calibrated = warpImage(self.img, self._transform, pipeline.tray, lazy=pipeline.lazy_warp)
+			self.img = None # Not needed anymore.
+			return False
+		else:
+			sensor_type = stage - 2
+			pattern, detector = pipeline.sensor_patterns[sensor_type], pipeline.sensor_detectors[sensor_type]
+			self._results += scoreSensors(self._img_calibrated, [pattern], [detector], pipeline.tray)[1]
+			if len(self._results) < len(pipeline.sensor_detectors):
+				return False
+			self.output = self._img_calibrated, combineResults(self._results), self._results
+			return True
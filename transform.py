@@ -1,4 +1,5 @@
-"""This module includes a function and the class which it returns, which wrap opencv's perspective (non-affine) transformation modules."""
+"""This module includes a function and the class which it returns, which wrap opencv's perspective (non-affine) transformation modules,
+and a class which applies such a transform to an image lazily, one region at a time."""
 import cv2
 import numpy as np
 
@@ -8,9 +9,24 @@ class PerspectiveTransform:
 		self.matrix = matrix
 		self.image_shape = image_shape
 
-	def transformImage(self, img):
-		"""Wrapper around `cv2.warpPerspective`, which takes an image and outputs a transformed image."""
-		return cv2.warpPerspective(img, self.matrix, self.image_shape)
+	def transformImage(self, img, dst=None):
+		"""Wrapper around `cv2.warpPerspective`, which takes an image and outputs a transformed image (optionally into `dst`)."""
+		return cv2.warpPerspective(img, self.matrix, self.image_shape, dst=dst)
+
+	def transformRegion(self, img, x1, y1, x2, y2, dst=None):
+		"""Like `transformImage`, but only produces the region `[y1:y2, x1:x2]` of the transformed image, at the cost of warping just that region.
+		
+		Args:
+		    img (numpy.ndarray): Image to be transformed.
+		    x1, y1, x2, y2 (int): Bounds of the region, in transformed image coordinates.
+		    dst (numpy.ndarray, optional): Output array.
+		
+		Returns:
+		    numpy.ndarray: Image of shape (y2 - y1, x2 - x1), the same as `transformImage(img)[y1:y2, x1:x2]` (up to interpolation rounding).
+		"""
+		# Shift the output so that (x1, y1) lands on (0, 0).
+		translation = np.array(((1, 0, -x1), (0, 1, -y1), (0, 0, 1)), dtype=self.matrix.dtype)
+		return cv2.warpPerspective(img, translation.dot(self.matrix), (x2 - x1, y2 - y1), dst=dst)
 
 	def transformPoints(self, points):
 		"""Wrapper around `cv2.perspectiveTransform`, which takes an array of points (sparse array) and transforms each point."""
@@ -39,21 +55,79 @@ class PerspectiveTransform:
 		return str(self.matrix)
 
 
-def getPerspectiveTransform(src_img, src_points, output_shape):
+class LazyWarpedImage:
+	"""Stands in for the transformed image `transform(img)`, without warping the whole image up front.
+	
+	Slicing it as `lazy_img[y1:y2, x1:x2]` (like `TrayDefinition.getCell` does) warps only that region from the source image,
+	so the cost of warping tracks the area actually looked at, rather than the whole plane including margins.
+	Each region is kept once warped, so reading the same cell again (e.g. once per type of sensor) doesn't warp it again.
+	Anything else (other indexing, `numpy.asarray(lazy_img)`) warps the whole image, which is then kept and used for any later reads.
+	
+	Attributes:
+	    transform (PerspectiveTransform): The transform.
+	    source (numpy.ndarray): The untransformed image.
+	    shape (tuple): Shape of the transformed image.
+	    ndim (int): Number of dimensions of the transformed image.
+	    dtype (numpy.dtype): dtype of the transformed image.
+	"""
+	def __init__(self, transform, source):
+		self.transform = transform
+		self.source = source
+
+		width, height = transform.image_shape
+		self.shape = (height, width) + source.shape[2:]
+		self.ndim = len(self.shape)
+		self.dtype = source.dtype
+
+		self._regions = {} # Warped regions, by (y1, y2, x1, x2).
+		self._image = None # The whole warped image, once something needed it.
+
+	def __getitem__(self, key):
+		if self._image is None and isinstance(key, tuple) and len(key) == 2 and all(isinstance(k, slice) and k.step in (None, 1) for k in key):
+			y1, y2, _ = key[0].indices(self.shape[0])
+			x1, x2, _ = key[1].indices(self.shape[1])
+			if y2 <= y1 or x2 <= x1:
+				return np.empty((0, 0) + self.shape[2:], dtype=self.dtype)
+			region = self._regions.get((y1, y2, x1, x2))
+			if region is None:
+				region = self._regions[(y1, y2, x1, x2)] = self.transform.transformRegion(self.source, x1, y1, x2, y2)
+			return region
+		return self.materialize()[key]
+
+	def materialize(self, dst=None):
+		"""Warps and returns the whole transformed image (into `dst`, if provided, even if it has already been warped)."""
+		if dst is not None:
+			return self.transform.transformImage(self.source, dst=dst)
+		if self._image is None:
+			self._image = self.transform.transformImage(self.source)
+			self._regions.clear()
+		return self._image
+
+	def __array__(self, dtype=None, copy=None):
+		img = self.materialize()
+		return img if dtype is None else img.astype(dtype)
+
+
+def getPerspectiveTransform(src_img, src_points, output_shape, bounds=None):
 	"""Gets the transform matrix that will map the 4 points `src_points` to the four corners of a flat plane of shape `output_shape`.
 	
 	Args:
 	    src_img (numpy.ndarray): Image that `src_points` are from.
 	    src_points (numpy.ndarray): Four points describing the four corners of the output plane (`shape=(4,2)`).
 	    output_shape (tuple): `(height, width)` of the output plane.
+	    bounds (tuple, optional): `(x1, y1, x2, y2)` box used to decide which point is which corner (each point goes to the nearest corner of the box).
+	        Defaults to the whole of `src_img`; use the points' bounding box when the image contains more than one plane (e.g. several trays).
 	
 	Returns:
 	    PerspectiveTransform: `PerspectiveTransform` object encapsulating the resulting transform matrix.
 	"""
-	output_shape = (output_shape[1], output_shape[0])
+	output_shape = (int(output_shape[1]), int(output_shape[0])) # cv2 needs integer sizes; tray dimensions can be fractional at some scales.
 	
 	# Determine which input points correspond to which of the 4 corners
-	img_corners = _fourCorners(src_img.shape[:2])
+	if bounds is None:
+		img_corners = _fourCorners(src_img.shape[:2])
+	else:
+		img_corners = _fourCorners(bounds[:2], bounds[2:])
 	dists = np.array([np.linalg.norm(img_corner - src_points, axis=1) for img_corner in img_corners])
 	correspondences = np.argmin(dists, axis=1) # img_corner i corresponds to the src_point at correspondences[i]
 	assert np.unique(correspondences).shape[0] == 4
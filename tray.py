@@ -1,4 +1,7 @@
-"""This module includes a class and a public function for loading trays from config files and working with them."""
+"""This module includes classes and a public function for loading trays from config files and working with them."""
+import os
+import threading
+
 import numpy as np
 from matplotlib.patches import Circle, Rectangle
 
@@ -6,7 +9,7 @@ from detector import CalibrationDetector
 from yaml_config import loadYAML
 
 
-_trays_data = None
+DEFAULT_TRAYS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "trays.yml")
 
 
 class TrayDefinition:
@@ -17,6 +20,7 @@ class TrayDefinition:
 	    Likewise for `width` and `cell_width * cols`.
 	
 	Attributes:
+	    data (yaml_config.YAMLDict): The data this tray was created from.
 	    cell_height (float): The height of each cell in the tray, i.e. the vertical distance from the center of one cell to the next.
 	    cell_width (float): The width of each cell in the tray, i.e. the horizontal distance from the center of one cell to the next.
 	    cols (int): Number of columns.
@@ -31,6 +35,7 @@ class TrayDefinition:
 	    scale (float, optional): Factor by which to scale all heights and widths.
 	"""
 	def __init__(self, data, scale=1):
+		self.data = data
 		self.scale = scale
 
 		self.name = data.name
@@ -132,20 +137,59 @@ class TrayDefinition:
 				yield row, col
 
 
-def getTrayDef(name, scale=1):
-	global _trays_data
+class TrayRegistry:
+	"""The tray specs in one YAML config file. The file is loaded the first time a tray is requested; safe to use from several threads.
+	
+	Args:
+	    path (str, optional): Path to the YAML config file. Defaults to the `trays.yml` next to this module.
+	"""
+	def __init__(self, path=DEFAULT_TRAYS_PATH):
+		self.path = path
+		self._data = None
+		self._lock = threading.Lock()
+
+	def _load(self):
+		"""Returns a dict of tray name to data, loading the file if it hasn't been loaded yet."""
+		if self._data is None:
+			with self._lock:
+				if self._data is None: # Another thread may have loaded it while this one was waiting for the lock.
+					self._data = {data.name: data for data in loadYAML(self.path, frozen=True)}
+		return self._data
+
+	def names(self):
+		"""Returns the names of all trays in the config file."""
+		return list(self._load())
+
+	def get(self, name, scale=1):
+		"""Loads a tray by name.
+		
+		Args:
+		    name (str): The name of the tray in the config file.
+		    scale (float, optional): The factor by which to scale all heights and widths.
+		
+		Returns:
+		    TrayDefinition: Creates a TrayDefinition object with the appropriate scale, or None if there is no tray with that name.
+		"""
+		data = self._load().get(name)
+		if data is None:
+			return None
+		return TrayDefinition(data, scale)
+
+
+_default_registry = TrayRegistry()
+
+
+def getTrayDef(name, scale=1, registry=None):
 	"""Loads a tray by name from the YAML config file.
 	
 	Args:
 	    name (str): The name of the tray in the config file.
 	    scale (float, optional): The factor by which to scale all heights and widths.
+	    registry (TrayRegistry, optional): Registry to load the tray from. Defaults to the registry for the `trays.yml` next to this module.
 	
 	Returns:
 	    TrayDefinition: Creates a TrayDefinition object with the appropriate scale.
 	"""
-	if _trays_data is None:
-		_trays_data = loadYAML("trays.yml")
-	
-	for data in _trays_data:
-		if data.name == name:
-			return TrayDefinition(data, scale)
+	if registry is None:
+		registry = _default_registry
+	return registry.get(name, scale)
@@ -0,0 +1,243 @@
+"""This module stores calibrated tray images in an archive that can be re-read without decoding or calibrating them again.
+
+An archive is a directory containing:
+    * `archive.json`: the image shape, dtype and chunk size.
+    * `chunk_00000.npy`, `chunk_00001.npy`, ...: arrays of `chunk_size` images each (`.npy` files, so they can be memory-mapped).
+    * `index.jsonl`: one line per image, in order, with its chunk, slot, transform matrix and metadata.
+
+Images are appended as they are produced (an existing archive is appended to), and read back as read-only views of the memory-mapped chunks,
+so re-scoring an archive skips decoding and calibrating the images. Whole chunks can be passed straight to `find_sensors.detectSensorsBatch`.
+
+Usage::
+
+    with TrayArchiveWriter("archive", (tray.height, tray.width)) as writer:
+        transform = pipeline.findTransform(img)
+        writer.append(warpImage(img, transform, tray), transform, {"path": path})
+
+    archive = TrayArchive("archive")
+    for images, records in archive.chunks():
+        best_matches, scores, centers = pipeline.detectSensorsBatch(images)
+"""
+import json
+import logging
+import os
+
+import numpy as np
+
+from transform import PerspectiveTransform
+
+
+HEADER_FILENAME = "archive.json"
+INDEX_FILENAME = "index.jsonl"
+
+
+def _chunkPath(path, chunk):
+	return os.path.join(path, "chunk_%05d.npy" %chunk)
+
+
+def _readHeader(path):
+	with open(os.path.join(path, HEADER_FILENAME)) as file:
+		header = json.load(file)
+	return tuple(header["shape"]), np.dtype(header["dtype"]), header["chunk_size"]
+
+
+def _readIndex(path):
+	index_path = os.path.join(path, INDEX_FILENAME)
+	if not os.path.exists(index_path):
+		return []
+
+	records = []
+	with open(index_path) as file:
+		for number, line in enumerate(file, 1):
+			if not line.endswith("\n"):
+				continue # Still being written, or cut short by a crash (the writer removes it when reopening).
+			try:
+				records.append(json.loads(line))
+			except ValueError:
+				logging.warning("%s line %d is corrupt; skipped." %(index_path, number))
+	return records
+
+
+def _repairIndex(path):
+	"""Truncates the index after its last complete line, removing a line left half-written by a crash, so that appending starts on a new line."""
+	index_path = os.path.join(path, INDEX_FILENAME)
+	if not os.path.exists(index_path):
+		return
+	with open(index_path, "rb+") as file:
+		data = file.read()
+		end = data.rfind(b"\n") + 1
+		if end != len(data):
+			logging.warning("%s ends with a partial line (%d bytes); removed." %(index_path, len(data) - end))
+			file.truncate(end)
+
+
+class TrayArchiveWriter:
+	"""Appends calibrated tray images to an archive, creating it if it doesn't exist.
+
+	Note:
+	    Only one writer may append to an archive at a time. Readers can read it while it's being written (see `TrayArchive.refresh`).
+
+	Attributes:
+	    path (str): Archive directory.
+	    shape (tuple): Shape of every image, e.g. `(tray.height, tray.width)`.
+	    dtype (numpy.dtype): dtype of every image.
+	    chunk_size (int): Number of images per chunk file.
+
+	Args:
+	    path (str): See attributes.
+	    shape (tuple): See attributes. Must match the archive, if it exists.
+	    dtype (numpy.dtype, optional): See attributes. Must match the archive, if it exists.
+	    chunk_size (int, optional): See attributes. Ignored if the archive exists.
+	"""
+	def __init__(self, path, shape, dtype=np.uint8, chunk_size=256):
+		self.path = path
+		shape, dtype = tuple(int(size) for size in shape), np.dtype(dtype)
+
+		if os.path.exists(os.path.join(path, HEADER_FILENAME)):
+			self.shape, self.dtype, self.chunk_size = _readHeader(path)
+			if (self.shape, self.dtype) != (shape, dtype):
+				raise ValueError("Archive %s holds %s %s images, not %s %s." %(path, self.shape, self.dtype, shape, dtype))
+		else:
+			os.makedirs(path, exist_ok=True)
+			self.shape, self.dtype, self.chunk_size = shape, dtype, chunk_size
+			with open(os.path.join(path, HEADER_FILENAME), "w") as file:
+				json.dump({"shape": list(shape), "dtype": dtype.str, "chunk_size": chunk_size}, file)
+
+		_repairIndex(path)
+		# Continue after the last record's slot (rather than counting records, in case a corrupt line was skipped).
+		records = _readIndex(path)
+		self._count = records[-1]["chunk"] * self.chunk_size + records[-1]["slot"] + 1 if records else 0
+		self._index = open(os.path.join(path, INDEX_FILENAME), "a")
+		self._chunk = None # Memory map of the chunk being written.
+		self._chunk_number = None
+
+	def __len__(self):
+		"""Number of slots used, including any whose index line was lost."""
+		return self._count
+
+	def append(self, img, transform=None, meta=None):
+		"""Appends a calibrated image.
+
+		Args:
+		    img (numpy.ndarray or transform.LazyWarpedImage): Calibrated image, e.g. from `find_sensors.calibrate`.
+		    transform (transform.PerspectiveTransform, optional): The transform it was calibrated with.
+		    meta (dict, optional): Any JSON-serializable data, e.g. the source path and capture time.
+
+		Returns:
+		    int: Position of the image in the archive (`chunk * chunk_size + slot`), which is its index in `TrayArchive` unless an index line was lost.
+		"""
+		chunk, slot = divmod(self._count, self.chunk_size)
+		if chunk != self._chunk_number:
+			self._openChunk(chunk)
+		self._chunk[slot] = np.asarray(img)
+
+		record = {"chunk": chunk, "slot": slot, "meta": meta or {}}
+		if transform is not None:
+			record["transform"] = np.asarray(transform.matrix).tolist()
+			record["transform_shape"] = list(transform.image_shape)
+		self._index.write(json.dumps(record) + "\n")
+
+		self._count += 1
+		return self._count - 1
+
+	def _openChunk(self, chunk):
+		if self._chunk is not None:
+			self._chunk.flush()
+		chunk_path = _chunkPath(self.path, chunk)
+		if os.path.exists(chunk_path):
+			self._chunk = np.load(chunk_path, mmap_mode="r+")
+		else:
+			self._chunk = np.lib.format.open_memmap(chunk_path, mode="w+", dtype=self.dtype, shape=(self.chunk_size,) + self.shape)
+		self._chunk_number = chunk
+
+	def flush(self):
+		"""Writes the images and the index appended so far to disk, making them visible to readers."""
+		if self._chunk is not None:
+			self._chunk.flush()
+		self._index.flush()
+
+	def close(self):
+		self.flush()
+		self._index.close()
+		self._chunk = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+
+class TrayArchive:
+	"""Reads an archive written by `TrayArchiveWriter`. Images are returned as read-only views of the memory-mapped chunk files (no copies).
+
+	Attributes:
+	    path (str): Archive directory.
+	    shape (tuple): Shape of every image.
+	    dtype (numpy.dtype): dtype of every image.
+	    chunk_size (int): Number of images per chunk file.
+	    records (list): Index entry of each image: `chunk`, `slot`, `meta`, and `transform`/`transform_shape` if a transform was stored.
+
+	Args:
+	    path (str): See attributes.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.shape, self.dtype, self.chunk_size = _readHeader(path)
+		self.records = _readIndex(path)
+		self._chunks = {} # Memory map of each chunk opened so far.
+
+	def refresh(self):
+		"""Re-reads the index, to pick up images appended (and flushed) since the archive was opened. Returns the number of new images."""
+		count = len(self.records)
+		self.records = _readIndex(self.path)
+		return len(self.records) - count
+
+	def __len__(self):
+		return len(self.records)
+
+	def __getitem__(self, index):
+		"""Returns the image at `index` (random access)."""
+		record = self.records[index]
+		return self._chunk(record["chunk"])[record["slot"]]
+
+	def __iter__(self):
+		"""Streams the images in order."""
+		for index in range(len(self)):
+			yield self[index]
+
+	def meta(self, index):
+		"""Returns the metadata stored with the image at `index`."""
+		return self.records[index]["meta"]
+
+	def transform(self, index):
+		"""Returns the `transform.PerspectiveTransform` stored with the image at `index`, or None."""
+		record = self.records[index]
+		if "transform" not in record:
+			return
+		return PerspectiveTransform(np.array(record["transform"]), tuple(record["transform_shape"]))
+
+	def chunks(self):
+		"""Generator yielding `(images, records)` for each chunk in order, where `images` is a view of the chunk's filled slots
+		(`shape=(n,) + shape`), e.g. for `find_sensors.detectSensorsBatch`, and `records` are their index entries.
+		(If a corrupt index line was skipped, that chunk's images are a copy of the remaining slots instead of a view.)"""
+		start = 0
+		while start < len(self.records):
+			chunk = self.records[start]["chunk"]
+			stop = start
+			while stop < len(self.records) and self.records[stop]["chunk"] == chunk:
+				stop += 1
+			records = self.records[start:stop]
+			slots = [record["slot"] for record in records]
+			if slots == list(range(len(slots))):
+				yield self._chunk(chunk)[:len(slots)], records
+			else:
+				yield self._chunk(chunk)[slots], records
+			start = stop
+
+	def _chunk(self, chunk):
+		array = self._chunks.get(chunk)
+		if array is None:
+			array = np.load(_chunkPath(self.path, chunk), mmap_mode="r")
+			self._chunks[chunk] = array
+		return array
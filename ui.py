@@ -1,7 +1,9 @@
 """This module includes classes which construct and manage UIs, as well as convenience functions for drawing on matplotlib `Axes`."""
 import logging
+import sys
 import tkinter as tk
 import tkinter.ttk as ttk
+from time import perf_counter
 
 import cv2
 import numpy as np
@@ -52,8 +54,9 @@ class TkUI:
 	    title (str, optional): Window title.
 	    secondary_window (bool, optional): If False, draws the Figure, sliders and TkTable on the same window. If True (default), draws the sliders and TkTable on a separate window.
 	    table_show_delta (bool, optional): Passed on to TkTable.
+	    table_max_refresh_rate (float, optional): Passed on to TkTable.
 	"""
-	def __init__(self, figure, title="TkUI", secondary_window=True, table_show_delta=True):
+	def __init__(self, figure, title="TkUI", secondary_window=True, table_show_delta=True, table_max_refresh_rate=None):
 		self.root = tk.Tk()
 		self.root.wm_title(title)
 
@@ -67,7 +70,7 @@ class TkUI:
 
 		# Creates a TkSliderManager and TkTable.
 		self.sliders = TkSliderManager(self.secondary_window or self.root)
-		self.table = TkTable(self.secondary_window or self.root, table_show_delta)
+		self.table = TkTable(self.secondary_window or self.root, table_show_delta, table_max_refresh_rate)
 
 	# Tkinter/TkAgg wrappers
 	def update(self):
@@ -203,19 +206,34 @@ class TkSliderManager:
 class TkTable:
 	"""A table (`ttk.Treeview`) that can be used to display any updating values.
 
+	Arrays are displayed one line per row (of their first axis), `page_rows` rows at a time; selecting the "rows ..." line above or below the page
+	moves to the previous or next page. When an array changes, only the lines whose text changed are updated.
+
 	Args:
 	    master (tkinter.Widget): Parent widget.
 	    show_delta (bool, optional): If True, displays a "Delta" column that calculates how much each value changes.
+	    max_refresh_rate (float, optional): If set, the table is redrawn at most this many times per second; values set in between are coalesced,
+	        and only the latest value of each entry is drawn. If not set, every `set` redraws immediately.
+	    page_rows (int, optional): Number of rows of an array displayed at a time. If None, all rows are displayed.
 	"""
-	def __init__(self, master, show_delta=True):
+	def __init__(self, master, show_delta=True, max_refresh_rate=None, page_rows=50):
 		self.master = master
 		self.show_delta = show_delta
+		self.max_refresh_rate = max_refresh_rate
+		self.page_rows = page_rows
 		self.names = set()
+		self.last_values = {}
+
+		self._pending = {} # Values set since the last refresh, when refreshes are rate-limited.
+		self._refresh_scheduled = False
+		self._last_refresh = 0
+		self._array_lines = {} # Lines currently displayed under each array entry.
+		self._array_offsets = {} # First row displayed for each array entry.
+		self._array_pages = {} # For each array entry, {line number: number of rows to move} for its "previous/next rows" lines.
 
 		headings = ("Name", "Value")
 		if show_delta:
 			headings = ("Name", "Value", "Delta")
-			self.last_values = {}
 
 		# Create a Frame to contain everything else.
 		self.container = ttk.Frame(self.master)
@@ -242,13 +260,40 @@ class TkTable:
 		# Set a format tag for displaying ndarrays in a fixed-width font.
 		self.tree.tag_configure("ndarray_line", font="Courier 9 bold")
 
+		self.tree.bind("<<TreeviewSelect>>", self._onSelect)
+
 	def set(self, name, value):
 		"""Sets the value of an entry, creating it if it doesn't exist.
 		
 		Args:
 		    name (str): The name of the entry. This acts as both the displayed label and the dictionary key.
 		    value (any): New value for the entry. If value is an `numpy.ndarray`, will be displayed in multiple lines (collapsible).
+		        Arrays are copied, so the caller can keep reusing (e.g. pooled) buffers.
 		"""
+		if isinstance(value, np.ndarray):
+			value = value.copy()
+
+		if self.max_refresh_rate is None:
+			self._apply(name, value)
+			return
+
+		self._pending[name] = value
+		if not self._refresh_scheduled:
+			# Refresh now if the last refresh was long enough ago, otherwise as soon as it will have been.
+			delay = max(0, 1 / self.max_refresh_rate - (perf_counter() - self._last_refresh))
+			self._refresh_scheduled = True
+			self.master.after(int(delay * 1000), self._refresh)
+
+	def _refresh(self):
+		"""Draws the values set since the last refresh."""
+		self._refresh_scheduled = False
+		self._last_refresh = perf_counter()
+		pending, self._pending = self._pending, {}
+		for name, value in pending.items():
+			self._apply(name, value)
+
+	def _apply(self, name, value):
+		"""Draws the new value of an entry."""
 		if isinstance(value, np.ndarray):
 			self._insertArray(name, value) # ndarrays get special treatment
 
@@ -278,17 +323,66 @@ class TkTable:
 			# If it's a new entry, create the header line.
 			self.tree.insert("", "end", name, values=(name, header), open=True)
 			self.names.add(name)
-		elif np.any(array != self.last_values[name]):
-			# If it's an existing entry but the value has changed, delete all the old lines.
-			self.tree.set(name, "Value", header)
-
-			old_lines = self.tree.get_children(name)
-			self.tree.delete(*old_lines)
-		else:
+			self._array_offsets[name] = 0
+		elif array.dtype == self.last_values[name].dtype and np.array_equal(array, self.last_values[name]):
 			# If it hasn't been updated, skip everything else.
 			return
+		else:
+			self.tree.set(name, "Value", header)
 
-		# Create a new lines as children of the header line.
-		lines = str(array).split("\n")
+		self._drawArrayLines(name, array)
+
+	def _drawArrayLines(self, name, array):
+		"""Displays the current page of an array's rows as children of its header line, updating only the lines whose text changed."""
+		num_rows = len(array) if array.ndim >= 2 else 1
+		page_rows = self.page_rows or num_rows
+		start = max(0, min(self._array_offsets[name], num_rows - page_rows))
+		stop = min(num_rows, start + page_rows)
+		self._array_offsets[name] = start
+
+		lines = _formatArrayRows(array, start, stop)
+		pages = {}
+		if start > 0:
+			lines.insert(0, "\u25b2 rows %d-%d" %(max(0, start - page_rows), start - 1))
+			pages[0] = -page_rows
+		if stop < num_rows:
+			pages[len(lines)] = page_rows
+			lines.append("\u25bc rows %d-%d of %d" %(stop, min(num_rows, stop + page_rows) - 1, num_rows))
+		self._array_pages[name] = pages
+
+		old_lines = self._array_lines.get(name, [])
 		for i, line in enumerate(lines):
-			self.tree.insert(name, "end", name + "~" + str(i), values=("", line), tags="ndarray_line")
+			item = name + "~" + str(i)
+			if i >= len(old_lines):
+				self.tree.insert(name, "end", item, values=("", line), tags="ndarray_line")
+			elif line != old_lines[i]:
+				self.tree.set(item, "Value", line)
+		if len(old_lines) > len(lines):
+			self.tree.delete(*(name + "~" + str(i) for i in range(len(lines), len(old_lines))))
+		self._array_lines[name] = lines
+
+	def _onSelect(self, event):
+		"""Moves an array to its previous/next page when its "rows ..." line is selected."""
+		for item in self.tree.selection():
+			name, _, line = item.rpartition("~")
+			rows = self._array_pages.get(name, {}).get(int(line)) if line.isdigit() else None
+			if rows:
+				self.tree.selection_remove(item)
+				self._array_offsets[name] += rows
+				self._drawArrayLines(name, self.last_values[name])
+
+
+def _formatArrayRows(array, start, stop):
+	"""Formats rows `start` to `stop` (of the first axis) of an array, one line per row.
+	Numbers are padded to the same width throughout the array, so that rows line up, and an unchanged row always gives the same line."""
+	if array.ndim < 2:
+		return [np.array2string(array, threshold=sys.maxsize, max_line_width=sys.maxsize)]
+
+	formatter = None
+	if array.size and array.dtype.kind in "iu":
+		width = max(len(str(array.min())), len(str(array.max())))
+		formatter = {"int": lambda value: "%*d" %(width, value)}
+	elif array.dtype.kind == "f":
+		formatter = {"float_kind": lambda value: "%10.4g" %value}
+
+	return [np.array2string(row, formatter=formatter, threshold=sys.maxsize, max_line_width=sys.maxsize).replace("\n", "") for row in array[start:stop]]
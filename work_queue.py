@@ -0,0 +1,276 @@
+"""This module provides a work queue, stored in a SQLite database file, for splitting a batch of images between worker processes on any number of hosts.
+
+Workers only need access to the same filesystem as the database (and the images); there is no broker process. Each job is claimed with a lease,
+which the worker renews while processing; if a worker crashes, its lease runs out and another worker reclaims the job.
+
+Note:
+    Lease times are compared against each host's own clock (SQLite has no server, so there is no shared clock to use instead).
+    Keep the hosts' clocks synchronized (e.g. with NTP), and set `max_clock_skew` to more than the worst expected difference between them:
+    an expired lease is only reclaimed once it has been expired for that long, so a host whose clock runs ahead can't take a job that is still held.
+
+    SQLite's locking relies on the filesystem. It works on local disks and on network filesystems with working `fcntl` locks (e.g. NFSv4, SMB),
+    but not on filesystems with broken locking. The database uses the default rollback journal rather than WAL for the same reason.
+"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+from time import sleep
+from time import time
+
+import numpy as np
+
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+	id INTEGER PRIMARY KEY,
+	path TEXT UNIQUE NOT NULL,
+	state TEXT NOT NULL DEFAULT 'pending',
+	worker TEXT,
+	lease_expires REAL,
+	attempts INTEGER NOT NULL DEFAULT 0,
+	enqueued_at REAL NOT NULL,
+	finished_at REAL,
+	result TEXT,
+	error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires);
+"""
+
+
+class WorkQueue:
+	"""A table of jobs (image paths) in a SQLite database.
+
+	Attributes:
+	    path (str): Path to the database file.
+	    lease_seconds (float): How long a claimed job stays claimed without being renewed.
+	    max_attempts (int): A job that has been claimed this many times without completing is marked as failed.
+	    max_clock_skew (float): Largest expected difference between the clocks of the hosts sharing the queue, in seconds (see the module docstring).
+
+	Args:
+	    path (str): Path to the database file. Created if it doesn't exist.
+	    lease_seconds (float, optional): See attributes.
+	    max_attempts (int, optional): See attributes.
+	    max_clock_skew (float, optional): See attributes.
+	"""
+	def __init__(self, path, lease_seconds=60, max_attempts=3, max_clock_skew=5):
+		self.path = path
+		self.lease_seconds = lease_seconds
+		self.max_attempts = max_attempts
+		self.max_clock_skew = max_clock_skew
+
+		# isolation_level=None: transactions are started explicitly, so that claiming a job can take the write lock up front.
+		self._connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+		self._lock = threading.Lock() # Serializes use of the connection between a worker and its lease renewal thread.
+		with self._lock:
+			self._connection.executescript(_SCHEMA)
+
+	def enqueue(self, paths):
+		"""Adds image paths to the queue. Paths that are already in the queue are ignored.
+
+		Returns:
+		    int: Number of jobs added.
+		"""
+		now = time()
+		with self._lock:
+			changes_before = self._connection.total_changes
+			cursor = self._connection.cursor()
+			cursor.execute("BEGIN IMMEDIATE")
+			cursor.executemany("INSERT OR IGNORE INTO jobs (path, enqueued_at) VALUES (?, ?)", ((os.path.abspath(path), now) for path in paths))
+			cursor.execute("COMMIT")
+			return self._connection.total_changes - changes_before
+
+	def claim(self, worker):
+		"""Atomically claims the next pending job, or a running job whose lease has expired.
+
+		Args:
+		    worker (str): Identifier of the claiming worker.
+
+		Returns:
+		    (int, str): Job id and image path, or None if there is nothing left to claim.
+		"""
+		with self._lock:
+			cursor = self._connection.cursor()
+			cursor.execute("BEGIN IMMEDIATE") # Takes the database write lock, so no other worker can claim the same job.
+			try:
+				now = time()
+				expired = now - self.max_clock_skew # Leases set by a host whose clock is behind this one's may look expired early.
+				# Jobs whose workers have crashed too many times are given up on.
+				cursor.execute(
+					"UPDATE jobs SET state = ?, error = ?, finished_at = ? WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+					(FAILED, "Lease expired %d times" %self.max_attempts, now, RUNNING, expired, self.max_attempts))
+
+				row = cursor.execute(
+					"SELECT id, path FROM jobs WHERE state = ? OR (state = ? AND lease_expires < ?) ORDER BY id LIMIT 1",
+					(PENDING, RUNNING, expired)).fetchone()
+				if row is not None:
+					cursor.execute(
+						"UPDATE jobs SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+						(RUNNING, worker, now + self.lease_seconds, row[0]))
+				cursor.execute("COMMIT")
+			except Exception:
+				cursor.execute("ROLLBACK")
+				raise
+		return row
+
+	def renew(self, job_id, worker):
+		"""Extends the lease on a job.
+
+		Returns:
+		    bool: False if the job is no longer held by this worker (e.g. its lease had already expired and it was reclaimed).
+		"""
+		return self._finish(job_id, worker, "lease_expires = ?", (time() + self.lease_seconds,))
+
+	def complete(self, job_id, worker, result):
+		"""Marks a job as done and stores its result (any JSON-serializable object).
+
+		Returns:
+		    bool: False if the job is no longer held by this worker, in which case the result is discarded.
+		"""
+		return self._finish(job_id, worker, "state = ?, finished_at = ?, result = ?", (DONE, time(), json.dumps(result)))
+
+	def fail(self, job_id, worker, error):
+		"""Marks a job as failed, with an error message."""
+		return self._finish(job_id, worker, "state = ?, finished_at = ?, error = ?", (FAILED, time(), str(error)))
+
+	def _finish(self, job_id, worker, assignments, values):
+		"""Updates a running job, only if it is still held by the given worker."""
+		with self._lock:
+			cursor = self._connection.execute(
+				"UPDATE jobs SET %s WHERE id = ? AND worker = ? AND state = ?" %assignments,
+				values + (job_id, worker, RUNNING))
+		return cursor.rowcount == 1
+
+	def secondsUntilClaimable(self):
+		"""Returns how long until `claim` can return a job, assuming no lease is renewed: 0 if a job is pending (or its lease has expired),
+		otherwise the time until the earliest lease expires, plus `max_clock_skew`. Returns None if no jobs are pending or running."""
+		with self._lock:
+			pending, earliest = self._connection.execute(
+				"SELECT SUM(state = ?), MIN(CASE WHEN state = ? THEN lease_expires END) FROM jobs", (PENDING, RUNNING)).fetchone()
+		if pending:
+			return 0
+		if earliest is None:
+			return
+		return max(0, earliest + self.max_clock_skew - time())
+
+	def status(self, window_seconds=300):
+		"""Summarizes the queue.
+
+		Args:
+		    window_seconds (float, optional): Throughput is measured over jobs finished in this many most recent seconds.
+
+		Returns:
+		    dict: Number of jobs in each state, `throughput` (jobs/s), `remaining` (pending + running), `eta` (seconds, or None), and `workers` (active worker ids).
+		"""
+		now = time()
+		with self._lock:
+			counts = dict(self._connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+			recent = self._connection.execute(
+				"SELECT COUNT(*) FROM jobs WHERE state = ? AND finished_at > ?", (DONE, now - window_seconds)).fetchone()[0]
+			workers = [row[0] for row in self._connection.execute(
+				"SELECT DISTINCT worker FROM jobs WHERE state = ? AND lease_expires > ?", (RUNNING, now))]
+
+		status = {state: counts.get(state, 0) for state in (PENDING, RUNNING, DONE, FAILED)}
+		status["remaining"] = status[PENDING] + status[RUNNING]
+		status["throughput"] = recent / window_seconds
+		status["eta"] = status["remaining"] / status["throughput"] if status["throughput"] else None
+		status["workers"] = workers
+		return status
+
+	def results(self):
+		"""Generator yielding `(path, result)` for every completed job."""
+		with self._lock:
+			rows = self._connection.execute("SELECT path, result FROM jobs WHERE state = ? ORDER BY id", (DONE,)).fetchall()
+		for path, result in rows:
+			yield path, json.loads(result)
+
+	def close(self):
+		self._connection.close()
+
+
+def defaultWorkerId():
+	"""Returns an identifier for this process that is unique across hosts: `hostname:pid`."""
+	return "%s:%d" %(socket.gethostname(), os.getpid())
+
+
+def runWorker(queue, pipeline, load, worker=None, max_jobs=None):
+	"""Claims and processes jobs until no jobs are pending or running.
+
+	When there is nothing to claim but other workers still hold jobs, this waits for their leases to expire, so that the jobs of crashed workers
+	are reclaimed even if every other worker has finished.
+
+	Args:
+	    queue (WorkQueue): The queue.
+	    pipeline (pipeline.Pipeline): Pipeline used to process each image.
+	    load (callable): Function that loads an image given its path, e.g. `lambda path: loadImage(path, **options)`.
+	    worker (str, optional): Worker identifier. Defaults to `defaultWorkerId()`.
+	    max_jobs (int, optional): Stop after this many jobs.
+
+	Returns:
+	    int: Number of jobs completed by this worker.
+	"""
+	if worker is None:
+		worker = defaultWorkerId()
+
+	completed = 0
+	while max_jobs is None or completed < max_jobs:
+		job = queue.claim(worker)
+		if job is None:
+			wait = queue.secondsUntilClaimable()
+			if wait is None:
+				break
+			sleep(max(wait, 0.1)) # The leases may be renewed meanwhile, in which case this waits again.
+			continue
+		job_id, path = job
+
+		# Renew the lease in the background while the job is processed.
+		stop = threading.Event()
+		renewer = threading.Thread(target=_renewLease, args=(queue, job_id, worker, stop), daemon=True)
+		renewer.start()
+		try:
+			output = pipeline.process(load(path))
+			if output is None:
+				queue.fail(job_id, worker, "Calibration failed")
+			elif queue.complete(job_id, worker, resultToJSON(output[1], output[2])):
+				completed += 1
+			else:
+				logging.warning("Lost the lease on job %d (%s); result discarded." %(job_id, path))
+		except Exception as e:
+			logging.exception("Job %d (%s) failed." %(job_id, path))
+			queue.fail(job_id, worker, repr(e))
+		finally:
+			stop.set()
+			renewer.join()
+
+	return completed
+
+
+def _renewLease(queue, job_id, worker, stop):
+	"""Renews the lease on a job every third of the lease time, until `stop` is set.
+	If renewing fails (e.g. "database is locked" while another host holds the write lock), it's retried sooner, while the lease is still valid."""
+	interval = queue.lease_seconds / 3
+	while not stop.wait(interval):
+		try:
+			if not queue.renew(job_id, worker):
+				logging.warning("Lost the lease on job %d; no longer renewing it." %job_id)
+				return
+			interval = queue.lease_seconds / 3
+		except Exception:
+			logging.exception("Failed to renew the lease on job %d; retrying." %job_id)
+			interval = max(1, queue.lease_seconds / 20)
+
+
+def resultToJSON(best_matches, results):
+	"""Converts the output of `find_sensors.detectSensors` into a JSON-serializable dict."""
+	return {
+		"best_matches": np.asarray(best_matches).tolist(),
+		"scores": [result.scores.tolist() for result in results],
+		"centers": [result.centers.tolist() for result in results],
+	}
@@ -1,4 +1,6 @@
 """This module deals with loading and using YAML configuration files."""
+from collections.abc import Mapping
+
 from yaml import safe_load # See http://pyyaml.org/wiki/PyYAMLDocumentation
 
 
@@ -29,15 +31,95 @@ def YAMLObject(obj):
 		return obj
 
 
-def loadYAML(path):
+class FrozenYAMLDict (Mapping):
+	"""An immutable, hashable version of `YAMLDict`. Values can be accessed as items or attributes, and it can be unpacked with `**`.
+	Safe to share between threads, and usable as a dict key (e.g. for caching things derived from a config)."""
+	def __init__(self, obj):
+		object.__setattr__(self, "_dict", {key: freeze(value) for key, value in obj.items()})
+		object.__setattr__(self, "_hash", None)
+
+	def __getitem__(self, key):
+		return self._dict[key]
+
+	def __iter__(self):
+		return iter(self._dict)
+
+	def __len__(self):
+		return len(self._dict)
+
+	def __getattr__(self, name):
+		try:
+			return self.__dict__["_dict"][name]
+		except KeyError:
+			raise AttributeError(name)
+
+	def __setattr__(self, name, value):
+		raise AttributeError("FrozenYAMLDict is immutable")
+
+	def __hash__(self):
+		if self._hash is None:
+			object.__setattr__(self, "_hash", hash(frozenset(self._dict.items())))
+		return self._hash
+
+	def __eq__(self, other):
+		return isinstance(other, Mapping) and dict(self.items()) == dict(other.items())
+
+	def __reduce__(self):
+		return (FrozenYAMLDict, (self._dict,))
+
+	def __repr__(self):
+		return "FrozenYAMLDict(%r)" %self._dict
+
+	def replace(self, **changes):
+		"""Returns a copy with the given top-level keys replaced."""
+		obj = dict(self._dict)
+		obj.update(changes)
+		return FrozenYAMLDict(obj)
+
+
+class FrozenYAMLList (tuple):
+	"""An immutable, hashable version of `YAMLList`."""
+	def __new__(cls, obj):
+		return tuple.__new__(cls, (freeze(item) for item in obj))
+
+	def __reduce__(self):
+		return (FrozenYAMLList, (tuple(self),))
+
+
+def freeze(obj):
+	"""Recursively converts dicts and lists (including `YAMLDict` and `YAMLList`) into `FrozenYAMLDict` and `FrozenYAMLList`. Other objects are returned as-is."""
+	if isinstance(obj, (FrozenYAMLDict, FrozenYAMLList)):
+		return obj
+	elif isinstance(obj, Mapping):
+		return FrozenYAMLDict(obj)
+	elif isinstance(obj, (list, tuple)):
+		return FrozenYAMLList(obj)
+	else:
+		return obj
+
+
+def thaw(obj):
+	"""Recursively converts any YAMLObject (frozen or not) back into plain dicts and lists, e.g. for `yaml.safe_dump`."""
+	if isinstance(obj, Mapping):
+		return {key: thaw(value) for key, value in obj.items()}
+	elif isinstance(obj, (list, tuple)):
+		return [thaw(item) for item in obj]
+	else:
+		return obj
+
+
+def loadYAML(path, frozen=False):
 	"""Loads a YAML file at the specified path, and returns it as a YAMLObject.
 	
 	Args:
 	    path (str): Path to the YAML file.
+	    frozen (bool, optional): If True, returns a `FrozenYAMLDict` or `FrozenYAMLList` instead.
 	
 	Returns:
 	    YAMLDict or YAMLList: The root item in the specified file, as a YAMLObject.
 	"""
 	with open(path) as file:
 		obj = safe_load(file)
+	if frozen:
+		return freeze(obj)
 	return YAMLObject(obj)